@@ -0,0 +1,126 @@
+"""
+Benchmark: fixed-count embedding batches vs. size-aware batches with adaptive splitting.
+
+Usage:
+    python benchmarks/bench_embedding_batching.py                 # 120 mixed-size texts, local stand-in server
+    python benchmarks/bench_embedding_batching.py --texts 300 --timeout 3
+
+Uses the local stand-in embedding server of bench_embedding_client.py, whose
+response time grows with the characters of the request, on a mixed corpus of
+short chunks and long (up to EMBEDDING_MAX_TEXT_LENGTH) pages, with a short
+client timeout. Compares:
+  - "fixed 5, fallback": the previous behaviour, batches of 5 texts, 3 attempts
+    per batch, then one request per document for the whole call;
+  - "fixed 5, split": batches of 5 texts, failed batches split in two;
+  - "size-aware": batches packed by EMBEDDING_BATCH_MAX_CHARS and
+    EMBEDDING_BATCH_SIZE, failed batches split in two.
+Reports requests per document, timed-out requests and texts/s.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+from loguru import logger  # noqa: E402
+
+import config  # noqa: E402
+from bench_embedding_client import start_server  # noqa: E402
+from vector_store import HuggingFaceAPIEmbeddings  # noqa: E402
+
+logger.remove()
+logger.add(sys.stderr, level="ERROR")  # Splits are expected here; the table below reports them
+
+
+def mixed_texts(count: int, seed: int = 11):
+    """Mostly short chunks (CHUNK_SIZE and below), with about one long page in ten."""
+    rng = random.Random(seed)
+    words = "housing contact seal terminal crimp pitch row temperature connector pin gold tin".split()
+    texts = []
+    for _ in range(count):
+        length = rng.randint(15_000, config.EMBEDDING_MAX_TEXT_LENGTH) if rng.random() < 0.1 else rng.randint(200, 2_000)
+        text = ""
+        while len(text) < length:
+            text += rng.choice(words) + " "
+        texts.append(text[:length])
+    return texts
+
+
+def fixed_with_fallback(api_url: str, texts, counters):
+    """Previous behaviour: batches of 5, 3 attempts, then per-document requests for everything."""
+    embeddings = []
+    try:
+        for i in range(0, len(texts), 5):
+            for attempt in range(3):
+                try:
+                    response = requests.post(api_url, json={"texts": texts[i:i + 5]}, timeout=config.EMBEDDING_TIMEOUT)
+                    response.raise_for_status()
+                    embeddings.extend(response.json()["embeddings"])
+                    break
+                except requests.exceptions.Timeout:
+                    counters["timeouts"] += 1
+                    if attempt == 2:
+                        raise
+    except requests.exceptions.Timeout:
+        embeddings = []
+        for text in texts:
+            try:
+                response = requests.post(api_url, json={"texts": [text]}, timeout=config.EMBEDDING_TIMEOUT)
+                response.raise_for_status()
+                embeddings.append(response.json()["embeddings"][0])
+            except requests.exceptions.Timeout:
+                counters["timeouts"] += 1
+                embeddings.append(None)
+    return embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--texts", type=int, default=120)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Fixed server time per request")
+    parser.add_argument("--per-kchar-ms", type=float, default=60.0, help="Server time per 1000 characters")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Client timeout per request (s)")
+    args = parser.parse_args()
+
+    config.EMBEDDING_TIMEOUT = args.timeout
+    server, stats = start_server(args.latency_ms / 1000, 0.0, 0.0, 8, per_char_s=args.per_kchar_ms / 1e6)
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/embed"
+    texts = mixed_texts(args.texts)
+    print(f"{len(texts)} texts, {sum(len(t) for t in texts) / 1e6:.1f} M chars, server {args.latency_ms:.0f} ms "
+          f"+ {args.per_kchar_ms:.0f} ms/1000 chars, client timeout {args.timeout:.1f} s, "
+          f"max {config.EMBEDDING_BATCH_SIZE} texts / {config.EMBEDDING_BATCH_MAX_CHARS} chars per size-aware batch")
+
+    def report(name, run):
+        requests_before = stats["requests"]
+        start = time.perf_counter()
+        vectors, timeouts = run()
+        elapsed = time.perf_counter() - start
+        sent = stats["requests"] - requests_before
+        missing = sum(1 for vector in vectors if vector is None) + len(texts) - len(vectors)
+        print(f"{name:<20} {sent / len(texts):5.2f} requests/doc  {timeouts:3d} timeouts ({timeouts / sent:5.1%})  "
+              f"{len(texts) / elapsed:6.1f} texts/s  {missing} missing")
+
+    def legacy():
+        counters = {"timeouts": 0}
+        return fixed_with_fallback(api_url, texts, counters), counters["timeouts"]
+
+    def client_run(batch_size, max_chars):
+        def run():
+            config.EMBEDDING_BATCH_SIZE, config.EMBEDDING_BATCH_MAX_CHARS = batch_size, max_chars
+            client = HuggingFaceAPIEmbeddings(api_url=api_url, max_concurrency=1)
+            return client.embed_documents(texts), client.timeouts
+        return run
+
+    size_aware = (config.EMBEDDING_BATCH_SIZE, config.EMBEDDING_BATCH_MAX_CHARS)
+    report("fixed 5, fallback", legacy)
+    report("fixed 5, split", client_run(5, 0))
+    report("size-aware", client_run(*size_aware))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
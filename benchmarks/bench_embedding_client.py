@@ -0,0 +1,139 @@
+"""
+Benchmark: embedding client, one fresh request per batch vs. pooled concurrent batches.
+
+Usage:
+    python benchmarks/bench_embedding_client.py                       # 200 chunks, local stand-in server
+    python benchmarks/bench_embedding_client.py --texts 400 --latency-ms 150 --handshake-ms 60
+
+Starts a local stand-in for the embedding API (EMBEDDING_API_URL format: POST
+{"texts": [...]} -> {"embeddings": [...]}) that answers after a fixed latency plus
+a per-text cost, and delays every new connection by --handshake-ms to stand in for
+the TLS handshake of the real endpoint. Reports texts/s and connections opened for
+the previous client (requests.post per batch, one batch at a time) and for
+HuggingFaceAPIEmbeddings with 1, 4 and 8 concurrent batches, then checks that
+all clients return the same vectors in the same order.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+import requests  # noqa: E402
+
+import config  # noqa: E402
+from vector_store import HuggingFaceAPIEmbeddings  # noqa: E402
+
+
+def fake_embedding(text: str, dimensions: int):
+    """Deterministic vector of a text, so the clients' outputs can be compared."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [round(rng.uniform(-1, 1), 6) for _ in range(dimensions)]
+
+
+def start_server(latency_s: float, per_text_s: float, handshake_s: float, dimensions: int, per_char_s: float = 0.0):
+    stats = {"connections": 0, "requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with lock:
+                stats["connections"] += 1
+            time.sleep(handshake_s)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            texts = body["texts"]
+            with lock:
+                stats["requests"] += 1
+            time.sleep(latency_s + per_text_s * len(texts) + per_char_s * sum(len(text) for text in texts))
+            payload = json.dumps({"embeddings": [fake_embedding(text, dimensions) for text in texts]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.handle_error = lambda request, client_address: None  # Clients that timed out and hung up
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def legacy_embed_documents(api_url: str, texts):
+    """The client as it was before the pooled session: a fresh requests.post per batch, in series."""
+    embeddings = []
+    batch_size = config.EMBEDDING_BATCH_SIZE
+    for i in range(0, len(texts), batch_size):
+        response = requests.post(api_url, headers={"Content-Type": "application/json"},
+                                 json={"texts": texts[i:i + batch_size]}, timeout=config.EMBEDDING_TIMEOUT)
+        response.raise_for_status()
+        embeddings.extend(response.json()["embeddings"])
+    return embeddings
+
+
+def synthetic_texts(count: int, seed: int = 3):
+    rng = random.Random(seed)
+    words = "housing contact seal terminal crimp pitch row temperature connector pin gold tin".split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(50, 400))) for _ in range(count)]
+
+
+def measure(name, func, texts, stats):
+    connections, requests_before = stats["connections"], stats["requests"]
+    start = time.perf_counter()
+    vectors = func(texts)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {len(texts) / elapsed:8.1f} texts/s  {elapsed:6.2f} s  "
+          f"{stats['requests'] - requests_before:4d} requests  {stats['connections'] - connections:4d} connections")
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Fixed server time per request")
+    parser.add_argument("--per-text-ms", type=float, default=5.0, help="Server time per embedded text")
+    parser.add_argument("--handshake-ms", type=float, default=40.0, help="Delay of every new connection")
+    parser.add_argument("--batch-size", type=int, default=5, help="Texts per request (count-only batching)")
+    args = parser.parse_args()
+    config.EMBEDDING_BATCH_SIZE = args.batch_size
+    config.EMBEDDING_BATCH_MAX_CHARS = 0  # Same batches for every client: this measures connections and concurrency
+
+    dimensions = config.EMBEDDING_DIMENSIONS
+    server, stats = start_server(args.latency_ms / 1000, args.per_text_ms / 1000, args.handshake_ms / 1000, dimensions)
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/embed"
+    texts = synthetic_texts(args.texts)
+    print(f"{len(texts)} texts, batch size {config.EMBEDDING_BATCH_SIZE}, server latency {args.latency_ms:.0f} ms "
+          f"+ {args.per_text_ms:.0f} ms/text, new connection {args.handshake_ms:.0f} ms")
+
+    reference = measure("requests.post per batch, serial", lambda t: legacy_embed_documents(api_url, t), texts, stats)
+    for concurrency in (1, 4, 8):
+        client = HuggingFaceAPIEmbeddings(api_url=api_url, max_concurrency=concurrency)
+        vectors = measure(f"pooled session, {concurrency} in flight", client.embed_documents, texts, stats)
+        if vectors != reference:
+            print("  ERROR: embeddings differ from the reference (order or content)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: embedding API vs. the local CPU backend (sentence-transformers and ONNX int8).
+
+Usage:
+    python benchmarks/bench_local_embeddings.py                        # 64 chunks, local stand-in for the API
+    python benchmarks/bench_local_embeddings.py --api-url "$EMBEDDING_API_URL" --texts 128 --threads 1,4,8
+
+Embeds the same synthetic chunks with HuggingFaceAPIEmbeddings and with
+LocalEmbeddings (EMBEDDING_MODEL_NAME on CPU, with sentence-transformers and with
+the int8 ONNX export, for each --threads value) and reports texts/s plus the model
+load time of the local backends. Without --api-url the API is the stand-in server of
+bench_embedding_client.py answering after --latency-ms + --per-text-ms per text;
+pass the real URL to compare against the deployed space. The local vectors are
+compared (cosine) with the sentence-transformers vectors and, with --api-url, with
+the API vectors, to check that they can be searched in the existing collections.
+Backends whose packages are not installed are reported as skipped.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PDF_METRICS_PATH", "")
+
+from loguru import logger
+
+import numpy as np  # noqa: E402
+
+import config  # noqa: E402
+from bench_embedding_client import start_server, synthetic_texts  # noqa: E402
+from vector_store import HuggingFaceAPIEmbeddings, LocalEmbeddings  # noqa: E402
+
+logger.remove()  # After the imports: bench_embedding_client configures the logger too
+logger.add(sys.stderr, level="WARNING")
+
+
+def cosine_summary(vectors, reference) -> str:
+    a, b = np.asarray(vectors, dtype=np.float64), np.asarray(reference, dtype=np.float64)
+    cosines = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return f"cosine mean {cosines.mean():.4f} min {cosines.min():.4f}"
+
+
+def measure(name, client, texts, load_s=None):
+    client.embed_query("warm-up")  # First call pays lazy initialisation, not part of the throughput
+    start = time.perf_counter()
+    vectors = client.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    load = f"  (model load {load_s:.1f} s)" if load_s is not None else ""
+    print(f"{name:<36} {len(texts) / elapsed:8.1f} texts/s  {elapsed:7.2f} s{load}")
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--texts", type=int, default=64)
+    parser.add_argument("--api-url", default=None, help="Real embedding API (default: local stand-in server)")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Stand-in API time per request")
+    parser.add_argument("--per-text-ms", type=float, default=60.0, help="Stand-in API time per embedded text")
+    parser.add_argument("--threads", default=f"1,{os.cpu_count()}", help="Comma-separated local thread counts")
+    parser.add_argument("--batch-size", type=int, default=None, help="Local texts per forward pass")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.texts)
+    server = None
+    if args.api_url:
+        api_url = args.api_url
+    else:
+        server, _ = start_server(args.latency_ms / 1000, args.per_text_ms / 1000, 0.04, config.EMBEDDING_DIMENSIONS)
+        api_url = f"http://127.0.0.1:{server.server_address[1]}/embed"
+    print(f"{len(texts)} texts, model {config.EMBEDDING_MODEL_NAME}, {os.cpu_count()} CPUs, "
+          f"API: {args.api_url or f'stand-in ({args.latency_ms:.0f} ms + {args.per_text_ms:.0f} ms/text)'}")
+
+    api_vectors = measure("API (pooled, concurrent batches)", HuggingFaceAPIEmbeddings(api_url=api_url), texts)
+    reference = None
+    for use_onnx in (False, True):
+        for threads in sorted({int(value) for value in args.threads.split(",")}):
+            name = f"local {'ONNX int8' if use_onnx else 'sentence-transformers'}, {threads} thread(s)"
+            try:
+                start = time.perf_counter()
+                client = LocalEmbeddings(config.EMBEDDING_MODEL_NAME, batch_size=args.batch_size,
+                                         threads=threads, use_onnx=use_onnx)
+                load_s = time.perf_counter() - start
+            except (ImportError, ValueError, OSError) as e:
+                print(f"{name:<36} skipped: {e}")
+                break
+            vectors = measure(name, client, texts, load_s)
+            if reference is None and not use_onnx:
+                reference = vectors
+            elif reference is not None:
+                print(f"  vs sentence-transformers: {cosine_summary(vectors, reference)}")
+            if args.api_url:
+                print(f"  vs API: {cosine_summary(vectors, api_vectors)}")
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: page rasterisation in threads vs. the shared-memory process pool.
+
+Usage:
+    python benchmarks/bench_render_pool.py                  # synthetic 12-page datasheet PDF
+    python benchmarks/bench_render_pool.py drawing.pdf      # a real PDF
+
+Renders and encodes every page the way the vision path does (render policy of
+config.py, PDF_IMAGE_FORMAT encoding in PDF_WORKER_THREADS threads) and reports
+pages/s for rendering under the per-file lock in threads, then for 1, 4 and 8
+rasterisation worker processes. Scaling is bounded by the number of CPU cores of
+the machine; run it on the deployment hardware.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+import fitz  # noqa: E402
+
+import config  # noqa: E402
+import pdf_processor  # noqa: E402
+from pdf_processor import _SharedPdf, encode_pil_image, render_page_image, render_page_in_process  # noqa: E402
+
+
+def synthetic_pdf(pages: int = 12) -> bytes:
+    """A vector-heavy A3 drawing with a table on every page, similar to connector datasheets."""
+    document = fitz.open()
+    for page_index in range(pages):
+        page = document.new_page(width=842, height=1191)
+        for i in range(60):
+            page.draw_line((40 + i * 3.8, 60), (800 - i * 2, 1100), color=(0, 0, 0), width=0.4)
+        for row in range(40):
+            y = 100 + row * 24
+            page.draw_rect(fitz.Rect(60, y, 780, y + 24), color=(0, 0, 0), width=0.5)
+            page.insert_text((70, y + 16), f"Page {page_index + 1} row {row}: Contact Systems MCP 2.8, "
+                                           f"Housing seal: radial, Temperature -40 to 125 C", fontsize=9)
+    return document.tobytes()
+
+
+def encode(img):
+    return encode_pil_image(img, format=config.PDF_IMAGE_FORMAT, quality=config.PDF_IMAGE_QUALITY)
+
+
+def run_threads(pdf_bytes: bytes, page_count: int) -> float:
+    import threading
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    lock = threading.Lock()
+
+    def one_page(page_num):
+        with lock:
+            img, _ = render_page_image(document[page_num])
+        return len(encode(img))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config.PDF_WORKER_THREADS) as threads:
+        list(threads.map(one_page, range(page_count)))
+    elapsed = time.perf_counter() - start
+    document.close()
+    return page_count / elapsed
+
+
+def run_processes(pdf_bytes: bytes, page_count: int, workers: int) -> float:
+    config.PDF_RENDER_PROCESSES = workers
+    pool = pdf_processor.get_render_process_pool()
+    shared_pdf = _SharedPdf(pdf_bytes)
+    try:
+        # Start the workers (and their imports) before timing
+        list(pool.map(abs, range(workers)))
+
+        def one_page(page_num):
+            img, _ = render_page_in_process(pool, shared_pdf, page_num)
+            return len(encode(img))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config.PDF_WORKER_THREADS) as threads:
+            list(threads.map(one_page, range(page_count)))
+        elapsed = time.perf_counter() - start
+    finally:
+        shared_pdf.close()
+        pool.shutdown()
+        pdf_processor._render_process_pool = None
+    return page_count / elapsed
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            pdf_bytes = f.read()
+        source = sys.argv[1]
+    else:
+        pdf_bytes = synthetic_pdf()
+        source = "synthetic"
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        page_count = document.page_count
+
+    print(f"{page_count} pages from {source}, {os.cpu_count()} CPUs, format {config.PDF_IMAGE_FORMAT}")
+    baseline = run_threads(pdf_bytes, page_count)
+    print(f"threads (render under per-file lock): {baseline:7.2f} pages/s")
+    for workers in (1, 4, 8):
+        rate = run_processes(pdf_bytes, page_count, workers)
+        print(f"process pool, {workers} worker(s):          {rate:7.2f} pages/s ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: single-pass dictionary tagger vs. the per-attribute regex tagger.
+
+Usage:
+    python benchmarks/bench_tagger.py                 # synthetic OCR markdown pages
+    python benchmarks/bench_tagger.py ./ocr_cache     # real pages from the OCR cache (*.md)
+
+Checks that both taggers produce identical tags on every page, then reports
+the mean time per page. "legacy" is the tagger as it was before the single-pass
+matcher, including its INFO logging; "regexes" is the same algorithm without logging.
+"""
+import os
+import sys
+import glob
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+# The legacy tagger logs at INFO for every attribute; keep that cost but not the noise
+logger.add(lambda message: None, level="INFO")
+
+import pdf_processor  # noqa: E402
+from pdf_processor import (  # noqa: E402
+    ATTRIBUTE_DICTIONARY,
+    ATTRIBUTE_REGEXES,
+    tag_chunk_with_dictionary,
+    tag_chunk_with_regexes,
+)
+
+
+def legacy_tag_chunk_with_dictionary(chunk_text, attribute_regexes):
+    """The tagger as it was before the single-pass matcher."""
+    tags = {}
+    logger.info(f"Tagging chunk with {len(attribute_regexes)} attribute regexes")
+    if "Contact Systems" in attribute_regexes:
+        contact_matches = attribute_regexes["Contact Systems"].findall(chunk_text)
+        logger.info(f"Contact Systems regex matches: {contact_matches}")
+        logger.info(f"Looking for 'MCP 2.8' in text: {'MCP 2.8' in chunk_text}")
+    for attr, regex in attribute_regexes.items():
+        match_list = sorted({m.strip() for m in regex.findall(chunk_text)})
+        if match_list:
+            tags[attr] = ", ".join(match_list)
+            logger.info(f"Found matches for '{attr}': {match_list}")
+        else:
+            tags[attr] = None
+            logger.debug(f"No matches found for '{attr}'")
+    found_attrs = [attr for attr, value in tags.items() if value is not None]
+    logger.info(f"Generated tags for {len(found_attrs)} attributes: {found_attrs}")
+    logger.debug(f"All generated tags: {tags}")
+    return tags
+
+
+def synthetic_pages(count: int = 40, seed: int = 7):
+    """Markdown pages shaped like Mistral Vision output of connector datasheets."""
+    rng = random.Random(seed)
+    values = [v for vals in ATTRIBUTE_DICTIONARY.values() for v in vals if v]
+    labels = list(ATTRIBUTE_DICTIONARY.keys()) + ["Part Number", "Drawing No.", "Weight [g]", "Revision"]
+    filler = ("The housing is designed for automotive applications and meets the requirements "
+              "of LV 214. Dimensions in mm unless otherwise specified. Tolerances per ISO 2768-m. "
+              "Not to scale. Subject to change without notice. Température de service voir tableau.").split()
+    pages = []
+    for page_index in range(count):
+        lines = [f"# Product Specification - Page {page_index + 1}", ""]
+        lines.append(f"**Part Number:** {rng.randint(1000000, 9999999)}-{rng.randint(1, 9)}")
+        lines.append(f"**Description:** {' '.join(rng.choice(filler) for _ in range(25))}")
+        lines.append("")
+        lines.append("## Technical Data")
+        lines.append("")
+        lines.append("| Attribute | Value | Unit | Remark |")
+        lines.append("|---|---|---|---|")
+        for _ in range(rng.randint(15, 40)):
+            lines.append(f"| {rng.choice(labels)} | {rng.choice(values)} | {rng.choice(['mm', '°C', 'N', '-', 'A'])} "
+                         f"| {' '.join(rng.choice(filler) for _ in range(4))} |")
+        lines.append("")
+        for _ in range(rng.randint(3, 10)):
+            lines.append(" ".join(rng.choice(filler + values) for _ in range(rng.randint(20, 60))))
+            lines.append("")
+        pages.append("\n".join(lines))
+    return pages
+
+
+def time_per_page(func, pages, *args, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            func(page, *args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages) * 1000
+
+
+def main():
+    if len(sys.argv) > 1:
+        pages = [open(path, encoding="utf-8").read() for path in sorted(glob.glob(os.path.join(sys.argv[1], "*.md")))]
+        source = sys.argv[1]
+    else:
+        pages = synthetic_pages()
+        source = "synthetic"
+    if not pages:
+        print(f"No pages found in {source}")
+        return
+
+    mismatches = sum(
+        1 for page in pages
+        if tag_chunk_with_dictionary(page) != tag_chunk_with_regexes(page, ATTRIBUTE_REGEXES)
+    )
+    avg_chars = sum(len(page) for page in pages) / len(pages)
+    print(f"{len(pages)} pages from {source}, {avg_chars:.0f} chars/page, "
+          f"{len(pdf_processor.ATTRIBUTE_MATCHER.attributes)} attributes")
+    print(f"Pages with different tags: {mismatches}")
+
+    legacy_ms = time_per_page(legacy_tag_chunk_with_dictionary, pages, ATTRIBUTE_REGEXES)
+    regex_ms = time_per_page(tag_chunk_with_regexes, pages, ATTRIBUTE_REGEXES)
+    single_ms = time_per_page(tag_chunk_with_dictionary, pages)
+    print(f"legacy (per-attribute regexes + INFO logs): {legacy_ms:8.2f} ms/page")
+    print(f"regexes (per-attribute, no logs):           {regex_ms:8.2f} ms/page")
+    print(f"single pass (Aho-Corasick):                 {single_ms:8.2f} ms/page "
+          f"({legacy_ms / single_ms:.1f}x vs legacy)")
+
+
+if __name__ == "__main__":
+    main()
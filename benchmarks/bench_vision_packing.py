@@ -0,0 +1,137 @@
+"""
+Benchmark: one page per vision request vs. small pages packed into shared requests.
+
+Usage:
+    python benchmarks/bench_vision_packing.py                  # synthetic 12-page PDF, simulated API
+    python benchmarks/bench_vision_packing.py datasheet.pdf    # a real PDF, simulated API
+    python benchmarks/bench_vision_packing.py datasheet.pdf --live   # real Mistral Vision calls (MISTRAL_API_KEY)
+
+Runs the vision path of process_single_pdf with PDF_PACK_PAGES=1 and then with
+PDF_PACK_PAGES=2 and 4 (OCR cache, checkpoints, duplicate detection and boilerplate
+stripping off) and reports requests/page, wall time/page and the mean per-page
+latency (from the page metrics records). The simulated API answers after a fixed request overhead
+plus a per-image and per-output-token time, which is what packing trades off; use
+--live to measure the real service.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The synthetic pages are alike, so boilerplate stripping would leave nothing to count
+os.environ.update(OCR_CACHE_ENABLED="false", PDF_CHECKPOINT_ENABLED="false", PDF_METRICS_PATH="",
+                  PDF_BOILERPLATE_ENABLED="false")
+
+from loguru import logger
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+import fitz  # noqa: E402
+
+import config  # noqa: E402
+import pdf_processor  # noqa: E402
+
+
+class _Simulated:
+    pass
+
+
+class SimulatedVisionClient:
+    """Stand-in for MistralClient: latency = overhead + per image + per output token."""
+
+    def __init__(self, overhead_s: float = 0.8, per_image_s: float = 0.15, per_token_s: float = 0.002):
+        self.overhead_s = overhead_s
+        self.per_image_s = per_image_s
+        self.per_token_s = per_token_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def chat(self, model, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        images = sum(1 for part in messages[0]["content"] if part["type"] == "image_url")
+        pages = ["# Page\n\n**Housing material:** PA66 GF30\n\n| Pin | Signal |\n|---|---|\n| 1 | CAN-H |"
+                 for _ in range(images)]
+        if images > 1:
+            text = "\n\n".join(f"<<<PAGE {k}>>>\n{page}" for k, page in enumerate(pages, 1))
+        else:
+            text = pages[0]
+        output_tokens = len(text) // 4
+        time.sleep(self.overhead_s + self.per_image_s * images + self.per_token_s * output_tokens)
+        response, choice, message, usage = _Simulated(), _Simulated(), _Simulated(), _Simulated()
+        message.content = text
+        choice.message = message
+        usage.prompt_tokens, usage.completion_tokens = 250 + 1000 * images, output_tokens
+        response.choices, response.usage = [choice], usage
+        return response
+
+
+def synthetic_pdf(pages: int = 12) -> bytes:
+    """Short pages: a cover sheet, revision notes and small pin tables."""
+    document = fitz.open()
+    for page_index in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 90), f"Connector family X - sheet {page_index + 1}", fontsize=16)
+        for row in range(6):
+            y = 140 + row * 22
+            page.draw_rect(fitz.Rect(72, y, 400, y + 22), color=(0, 0, 0), width=0.5)
+            page.insert_text((80, y + 15), f"Pin {row + 1}   CAN-H   0.35 mm²", fontsize=10)
+    return document.tobytes()
+
+
+def run(pdf_bytes: bytes, pack_pages: int, client) -> dict:
+    config.PDF_PACK_PAGES = pack_pages
+    calls_before = getattr(client, "calls", 0)
+    records = []
+    start = time.perf_counter()
+    docs = asyncio.run(pdf_processor.process_single_pdf(
+        pdf_bytes, "bench.pdf", client, config.VISION_MODEL_NAME, strategy="vision", page_records=records))
+    elapsed = time.perf_counter() - start
+    pages = len(records)
+    api_calls = sum(record.get("api_calls") or 0 for record in records)
+    return {
+        "pages": pages,
+        "docs": len(docs),
+        "requests_per_page": api_calls / pages if pages else 0.0,
+        "wall_s_per_page": elapsed / pages if pages else 0.0,
+        "mean_latency_s": sum(record["total_ms"] for record in records) / pages / 1000 if pages else 0.0,
+        "client_calls": getattr(client, "calls", calls_before) - calls_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf", nargs="?", help="PDF to process (default: synthetic short pages)")
+    parser.add_argument("--live", action="store_true", help="Call Mistral Vision instead of the simulated API")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = synthetic_pdf()
+    if args.live:
+        from mistralai.client import MistralClient
+        client = MistralClient(api_key=os.getenv("MISTRAL_API_KEY"), max_retries=1)
+    else:
+        client = SimulatedVisionClient()
+
+    config.PDF_DEDUP_ENABLED = False
+    print(f"{args.pdf or 'synthetic'}, {'live API' if args.live else 'simulated API'}, "
+          f"page concurrency {config.PDF_PAGE_CONCURRENCY}")
+    baseline = None
+    for pack_pages in (1, 2, 4):
+        result = run(pdf_bytes, pack_pages, client)
+        baseline = baseline or result
+        print(f"PDF_PACK_PAGES={pack_pages}: {result['docs']} documents from {result['pages']} pages, "
+              f"{result['requests_per_page']:.2f} requests/page, {result['wall_s_per_page']:.2f} s/page wall, "
+              f"{result['mean_latency_s']:.2f} s mean page latency "
+              f"({baseline['wall_s_per_page'] / result['wall_s_per_page']:.2f}x throughput)")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,16 +19,74 @@ LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "qwen/qwen3-32b") # Reverted to a k
 # --- Vision Model Configuration ---
 VISION_MODEL_NAME = os.getenv("VISION_MODEL_NAME", "mistral-small-latest")
 
+# --- PDF Processing Configuration ---
+PDF_PAGE_CONCURRENCY = int(os.getenv("PDF_PAGE_CONCURRENCY", 4))  # Max pages of one PDF in flight to the vision API
+PDF_FILE_CONCURRENCY = int(os.getenv("PDF_FILE_CONCURRENCY", 4))  # Max PDFs of one batch processed at the same time
+PDF_WORKER_THREADS = int(os.getenv("PDF_WORKER_THREADS", 16))  # Shared pool for rendering and vision calls, across all users
+PDF_EXTRACTION_STRATEGY = os.getenv("PDF_EXTRACTION_STRATEGY", "vision")  # "vision", "text" (embedded text layer only) or "auto"
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", 200))  # Below this a page is treated as scanned ("auto" strategy)
+PDF_TEXT_MIN_DENSITY = float(os.getenv("PDF_TEXT_MIN_DENSITY", 2.0))  # Minimum characters per square inch of page
+PDF_TEXT_MAX_IMAGE_RATIO = float(os.getenv("PDF_TEXT_MAX_IMAGE_RATIO", 0.5))  # Image-heavy pages above this coverage go to vision
+PDF_TABLES_ENABLED = os.getenv("PDF_TABLES_ENABLED", "true").lower() == "true"  # Rebuild text-layer tables as markdown tables
+PDF_TABLE_MIN_FILL_RATIO = float(os.getenv("PDF_TABLE_MIN_FILL_RATIO", 0.3))  # Detected tables emptier than this go to vision
+PDF_TABLE_MIN_RULINGS = int(os.getenv("PDF_TABLE_MIN_RULINGS", 12))  # Ruled pages without a readable table go to vision, 0 disables
+PDF_PAGE_PRIORITY_ENABLED = os.getenv("PDF_PAGE_PRIORITY_ENABLED", "true").lower() == "true"  # OCR likely spec pages first
+PDF_VISION_PAGE_BUDGET = int(os.getenv("PDF_VISION_PAGE_BUDGET", 0))  # Max pages per file sent to vision (best scored first; text-layer and cached pages do not count), 0 = all
+PDF_PACK_PAGES = int(os.getenv("PDF_PACK_PAGES", 1))  # >1: up to this many small pages per vision request
+PDF_PACK_MAX_PAGE_KB = int(os.getenv("PDF_PACK_MAX_PAGE_KB", 200))  # Pages with a larger encoded image are sent alone
+PDF_PACK_MAX_PAGE_CHARS = int(os.getenv("PDF_PACK_MAX_PAGE_CHARS", 1500))  # Pages with a longer text layer are sent alone
+PDF_PACK_PIXEL_BUDGET = int(os.getenv("PDF_PACK_PIXEL_BUDGET", 40_000_000))  # Max pixels of all images of one packed request (4 A4 pages at 300 DPI)
+PDF_PACK_TOKEN_BUDGET = int(os.getenv("PDF_PACK_TOKEN_BUDGET", 2000))  # Max estimated output tokens of one packed request
+PDF_PACK_LINGER_MS = int(os.getenv("PDF_PACK_LINGER_MS", 200))  # Max wait for more small pages before sending a pack
+PDF_BOILERPLATE_ENABLED = os.getenv("PDF_BOILERPLATE_ENABLED", "false").lower() == "true"  # Strip lines repeated across pages before chunking; holds a file's pages until all are extracted (no per-page streaming)
+PDF_BOILERPLATE_MIN_PAGE_RATIO = float(os.getenv("PDF_BOILERPLATE_MIN_PAGE_RATIO", 0.6))  # Share of pages a line must appear on
+PDF_BOILERPLATE_MIN_PAGES = int(os.getenv("PDF_BOILERPLATE_MIN_PAGES", 3))  # Shorter documents are not stripped
+PDF_RENDER_MAX_DPI = int(os.getenv("PDF_RENDER_MAX_DPI", 300))
+PDF_RENDER_MIN_DPI = int(os.getenv("PDF_RENDER_MIN_DPI", 100))
+PDF_RENDER_PIXEL_BUDGET = int(os.getenv("PDF_RENDER_PIXEL_BUDGET", 9_000_000))  # Max pixels per page image (~A4 at 300 DPI), 0 disables
+PDF_RENDER_MEMORY_BUDGET_MB = int(os.getenv("PDF_RENDER_MEMORY_BUDGET_MB", 512))  # Max memory of concurrent page renders/encodes, 0 disables
+PDF_RENDER_PROCESSES = int(os.getenv("PDF_RENDER_PROCESSES", 0))  # >0: rasterise pages in that many worker processes
+PDF_RENDER_GRAYSCALE = os.getenv("PDF_RENDER_GRAYSCALE", "true").lower() == "true"  # Render monochrome pages as 8-bit grayscale
+PDF_IMAGE_FORMAT = os.getenv("PDF_IMAGE_FORMAT", "PNG")  # PNG (lossless), JPEG or WEBP
+PDF_IMAGE_QUALITY = int(os.getenv("PDF_IMAGE_QUALITY", 85))  # JPEG/WEBP quality
+VISION_RATE_LIMIT_RPS = float(os.getenv("VISION_RATE_LIMIT_RPS", 5.0))  # Max vision requests per second, whole process
+VISION_RATE_BURST = int(os.getenv("VISION_RATE_BURST", 5))  # Requests that may be sent at once after an idle period
+VISION_MAX_IN_FLIGHT = int(os.getenv("VISION_MAX_IN_FLIGHT", 8))  # Upper bound of the adaptive (AIMD) concurrency window
+VISION_MAX_RETRIES = int(os.getenv("VISION_MAX_RETRIES", 4))  # Retries of a page on 429/5xx/connection errors
+VISION_RETRY_BASE_DELAY = float(os.getenv("VISION_RETRY_BASE_DELAY", 2.0))  # Seconds, doubled at each retry without Retry-After
+PDF_CHECKPOINT_ENABLED = os.getenv("PDF_CHECKPOINT_ENABLED", "true").lower() == "true"  # Resume interrupted ingests page by page
+PDF_CHECKPOINT_DIR = os.getenv("PDF_CHECKPOINT_DIR", "./ocr_checkpoints")  # One manifest per (file hash, model, strategy, prompt version)
+PDF_METRICS_PATH = os.getenv("PDF_METRICS_PATH", "")  # Per-page/file/batch measurement records appended as JSON lines (e.g. ./pdf_metrics.jsonl), "" disables
+PDF_DEDUP_ENABLED = os.getenv("PDF_DEDUP_ENABLED", "true").lower() == "true"  # OCR exact repeats (same rendering or same text layer) of an upload batch once
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"  # Reuse vision OCR results of already seen pages
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "./ocr_cache")
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", 512))  # Least recently used entries are evicted above this size
+
 # --- Embedding Configuration ---
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-m3")
 
 # --- API Embedding Configuration ---
 USE_API_EMBEDDINGS = os.getenv("USE_API_EMBEDDINGS", "true").lower() == "true"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "api" if USE_API_EMBEDDINGS else "local")  # "api" (EMBEDDING_API_URL) or "local" (CPU in this process)
 EMBEDDING_API_URL = os.getenv("EMBEDDING_API_URL", "https://sabrinekh-embedder-model.hf.space/embed")
 EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 1024))  # Default to 1024 for BAAI/bge-m3
-EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 5))  # Reduced default for large files
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))  # Max texts per embedding request
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", 24000))  # Max characters per embedding request, 0 = count only
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))  # Embedding batches in flight at the same time (pooled keep-alive connections)
 EMBEDDING_TIMEOUT = int(os.getenv("EMBEDDING_TIMEOUT", 120))  # Increased timeout for large files
 EMBEDDING_MAX_TEXT_LENGTH = int(os.getenv("EMBEDDING_MAX_TEXT_LENGTH", 30000))  # Max characters per text
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"  # Reuse embeddings of already embedded texts
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 512))  # Least recently used vectors are evicted above this size
+QUERY_EMBEDDINGS_DIR = os.getenv("QUERY_EMBEDDINGS_DIR", "./query_embeddings")  # Precomputed embeddings of the attribute queries
+STREAM_INDEX_BATCH_SIZE = int(os.getenv("STREAM_INDEX_BATCH_SIZE", 8))  # Max documents per micro-batch when indexing while OCR runs
+
+# --- Local Embedding Configuration (EMBEDDING_BACKEND=local) ---
+EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", 16))  # Texts per forward pass
+EMBEDDING_LOCAL_THREADS = int(os.getenv("EMBEDDING_LOCAL_THREADS", 0))  # CPU threads of the model, 0 = library default (all cores)
+EMBEDDING_LOCAL_MAX_TOKENS = int(os.getenv("EMBEDDING_LOCAL_MAX_TOKENS", 0))  # Tokens kept per text, 0 = model default (8192 for bge-m3)
+EMBEDDING_LOCAL_ONNX = os.getenv("EMBEDDING_LOCAL_ONNX", "false").lower() == "true"  # int8 quantised ONNX export run with ONNX Runtime
+EMBEDDING_LOCAL_ONNX_DIR = os.getenv("EMBEDDING_LOCAL_ONNX_DIR", "./onnx_models")  # Exported once per model (the export needs torch)
 
 # --- Vector Store Configuration ---
 # Define the persistence directory (can be None for in-memory)
@@ -39,8 +97,9 @@ COLLECTION_NAME = os.getenv("COLLECTION_NAME", "pdf_qa_prod_collection") # Use t
 is_persistent = bool(CHROMA_PERSIST_DIRECTORY) # True if directory is set, False otherwise
 
 # --- Text Splitting Configuration ---
-# CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", (1000)))  # Restored
-# CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))  # Restored
+CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "true").lower() == "true"  # Split pages on headings/tables into chunks
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 2000))  # Max characters per chunk (pages below this stay whole)
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))  # Only used when a single paragraph is longer than CHUNK_SIZE
 
 # --- Retriever Configuration ---
 RETRIEVER_K = int(os.getenv("RETRIEVER_K", 8)) # Renamed from RETRIEVER_SEARCH_K
@@ -0,0 +1,231 @@
+# ingest.py
+"""
+Headless bulk ingest of a directory tree of PDFs into the Chroma collection.
+
+Usage:
+    python ingest.py /archive/datasheets
+    python ingest.py /archive/datasheets --strategy auto --file-concurrency 8 --page-concurrency 4 --files-per-batch 16
+
+Reuses the Streamlit pipeline (process_uploaded_pdfs, then setup_vector_store into
+config.COLLECTION_NAME). Files whose content hash was already fully ingested into the
+collection are skipped; the hashes are kept in a manifest next to the Chroma data.
+Files with failed pages are retried on the next run (their page checkpoints fill the
+gaps). Chunks carry their file's hash and a stable id, and a file's earlier chunks are
+deleted before it is indexed again, so re-runs and --force never index a chunk twice.
+Ends with a throughput report (pages/s, embedding batches/s, failures).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ingest a directory tree of PDFs into the Chroma collection.")
+    parser.add_argument("root", help="Directory searched recursively for *.pdf files")
+    parser.add_argument("--strategy", choices=["vision", "text", "auto"], default=None,
+                        help="Page extraction strategy (default: PDF_EXTRACTION_STRATEGY)")
+    parser.add_argument("--file-concurrency", type=int, default=None, help="PDFs processed at the same time")
+    parser.add_argument("--page-concurrency", type=int, default=None, help="Pages of one PDF in flight to the vision API")
+    parser.add_argument("--worker-threads", type=int, default=None, help="Size of the shared PDF worker thread pool")
+    parser.add_argument("--files-per-batch", type=int, default=8,
+                        help="PDFs extracted before their chunks are embedded and indexed (bounds memory)")
+    parser.add_argument("--manifest", default=None,
+                        help="JSON file of ingested content hashes (default: <CHROMA_PERSIST_DIRECTORY>/ingested_files.json)")
+    parser.add_argument("--force", action="store_true", help="Re-ingest files even if their hash is in the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="List the files that would be ingested and exit")
+    parser.add_argument("--report-json", default=None, help="Also write the end-of-run report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def find_pdfs(root: str) -> List[str]:
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Concurrency settings are read by config at import time, so set them before importing the pipeline
+    for flag, env_name in (("file_concurrency", "PDF_FILE_CONCURRENCY"),
+                           ("page_concurrency", "PDF_PAGE_CONCURRENCY"),
+                           ("worker_threads", "PDF_WORKER_THREADS")):
+        if getattr(args, flag) is not None:
+            os.environ[env_name] = str(getattr(args, flag))
+
+    from loguru import logger
+    import config
+    import fitz
+    from pdf_processor import PeakRSSMonitor, process_uploaded_pdfs, run_pdf_coroutine
+    from vector_store import delete_documents_where, get_embedding_function, setup_vector_store
+
+    manifest_path = args.manifest or os.path.join(config.CHROMA_PERSIST_DIRECTORY or ".", "ingested_files.json")
+    manifest = load_manifest(manifest_path)
+    ingested = manifest.setdefault(config.COLLECTION_NAME, {})  # content hash -> file record
+
+    # --- Select the files to ingest ---
+    pending: List[Tuple[str, str]] = []  # (path, content hash)
+    seen_hashes = set()
+    skipped = 0
+    for path in find_pdfs(args.root):
+        with open(path, "rb") as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        # Entries written before pages_failed was recorded fall back to pages_missing
+        entry = ingested.get(file_hash)
+        complete = entry is not None and not entry.get("pages_failed", entry.get("pages_missing"))
+        if file_hash in seen_hashes or (complete and not args.force):
+            skipped += 1
+            logger.debug(f"Skipping already ingested file: {path}")
+            continue
+        seen_hashes.add(file_hash)
+        pending.append((path, file_hash))
+    logger.info(f"{len(pending)} PDF files to ingest, {skipped} skipped (already ingested) under {args.root}")
+    if args.dry_run:
+        for path, _ in pending:
+            print(path)
+        return 0
+    if not pending:
+        return 0
+
+    embedding_function = get_embedding_function()
+    if embedding_function is None:
+        logger.error("No embedding function available, aborting")
+        return 1
+    batches_before = getattr(embedding_function, "batches_sent", 0)
+
+    report: Dict[str, Any] = {"files_found": len(pending) + skipped, "files_skipped": skipped, "files_ingested": 0,
+                              "files_partial": 0, "files_failed": 0, "pages": 0, "pages_missing": 0, "chunks": 0,
+                              "extract_seconds": 0.0, "index_seconds": 0.0, "failed_files": []}
+    start = time.perf_counter()
+    batch_size = max(1, args.files_per_batch)
+    rss_monitor = PeakRSSMonitor().start()
+    for batch_start in range(0, len(pending), batch_size):
+        batch = pending[batch_start:batch_start + batch_size]
+        uploads, page_counts = [], {}
+        for path, _ in batch:
+            source = os.path.relpath(path, args.root)  # Unique within the tree, unlike the bare file name
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+            try:
+                with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+                    page_counts[source] = document.page_count
+            except Exception as e:
+                logger.error(f"Cannot open {path}: {e}")
+                report["files_failed"] += 1
+                report["failed_files"].append(path)
+                continue
+            uploads.append((source, pdf_bytes))
+        logger.info(f"Batch {batch_start // batch_size + 1}: extracting {len(uploads)} files")
+
+        extract_start = time.perf_counter()
+        page_records: List[Dict[str, Any]] = []
+        docs = run_pdf_coroutine(process_uploaded_pdfs(uploads, strategy=args.strategy,
+                                                       page_records=page_records)) if uploads else []
+        report["extract_seconds"] += time.perf_counter() - extract_start
+        del uploads
+
+        hash_by_source = {os.path.relpath(path, args.root): file_hash for path, file_hash in batch}
+        failed_by_source: Dict[str, int] = {}
+        for record in page_records:
+            if record.get("outcome") == "failed":
+                failed_by_source[record["source"]] = failed_by_source.get(record["source"], 0) + 1
+        pages_by_source: Dict[str, set] = {}
+        for doc in docs:
+            pages_by_source.setdefault(doc.metadata["source"], set()).add(doc.metadata["page"])
+            doc.metadata["file_hash"] = hash_by_source[doc.metadata["source"]]
+        # Same file, page and chunk -> same id: chunks indexed by an earlier run are replaced, not duplicated
+        ids = [f"{doc.metadata['file_hash']}:{doc.metadata['page']}:{doc.metadata.get('chunk', 0)}" for doc in docs]
+
+        index_start = time.perf_counter()
+        indexed = False
+        if docs:
+            indexed = setup_vector_store(docs, embedding_function, ids=ids) is not None
+        if indexed:
+            try:
+                # Only after the upsert succeeded: chunks of an earlier (partial or forced) ingest of these
+                # files that the new ids did not replace, e.g. a page that now splits into fewer chunks
+                delete_documents_where("file_hash", sorted({doc.metadata["file_hash"] for doc in docs}), keep_ids=ids)
+            except Exception as e:
+                logger.warning(f"Could not delete stale chunks of the batch, they stay searchable until the next ingest: {e}")
+        report["index_seconds"] += time.perf_counter() - index_start
+
+        for path, file_hash in batch:
+            source = os.path.relpath(path, args.root)
+            if source not in page_counts:
+                continue
+            pages = len(pages_by_source.get(source, ()))
+            if not pages or not indexed:
+                report["files_failed"] += 1
+                report["failed_files"].append(path)
+                ingested.pop(file_hash, None)  # A failed re-ingest may have replaced part of its chunks: retry next run
+                continue
+            missing = page_counts[source] - pages  # Failed, empty or skipped (vision page budget) pages
+            failed = failed_by_source.get(source, 0)
+            report["files_ingested"] += 1
+            report["files_partial"] += 1 if failed else 0
+            report["pages"] += pages
+            report["pages_missing"] += missing
+            ingested[file_hash] = {"path": path, "pages": page_counts[source], "pages_missing": missing, "pages_failed": failed,
+                                   "ingested_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if indexed:
+            report["chunks"] += len(docs)
+        save_manifest(manifest_path, manifest)  # After every batch, so an interrupted run keeps its progress
+
+    peak_rss_bytes = rss_monitor.stop()
+    elapsed = time.perf_counter() - start
+    embed_batches = getattr(embedding_function, "batches_sent", 0) - batches_before
+    report.update({
+        "elapsed_seconds": round(elapsed, 1),
+        "pages_per_second": round(report["pages"] / elapsed, 3) if elapsed else 0.0,
+        "embed_batches": embed_batches,
+        "embed_batches_per_second": round(embed_batches / report["index_seconds"], 3) if report["index_seconds"] else 0.0,
+        "extract_seconds": round(report["extract_seconds"], 1),
+        "index_seconds": round(report["index_seconds"], 1),
+        "peak_rss_mb": round(peak_rss_bytes / 1e6),
+    })
+    cache = getattr(embedding_function, "cache", None)
+    if cache is not None:
+        report["embedding_cache"] = cache.stats()
+
+    print("\nIngest report")
+    print(f"  files: {report['files_found']} found, {report['files_skipped']} skipped, "
+          f"{report['files_ingested']} ingested ({report['files_partial']} with failed pages, retried next run), "
+          f"{report['files_failed']} failed")
+    print(f"  pages: {report['pages']} ingested, {report['pages_missing']} missing; chunks: {report['chunks']}")
+    print(f"  time: {report['elapsed_seconds']} s (extraction {report['extract_seconds']} s, "
+          f"embedding/indexing {report['index_seconds']} s)")
+    print(f"  throughput: {report['pages_per_second']} pages/s, {report['embed_batches_per_second']} embed batches/s "
+          f"({report['embed_batches']} batches)")
+    print(f"  peak RSS: {report['peak_rss_mb']} MB")
+    if "embedding_cache" in report:
+        print(f"  embedding cache: {report['embedding_cache']['hits']} hits, {report['embedding_cache']['misses']} misses "
+              f"({report['embedding_cache']['hit_rate']:.0%})")
+    for path in report["failed_files"]:
+        print(f"  failed: {path}")
+    if args.report_json:
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    return 1 if report["files_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
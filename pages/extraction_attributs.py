@@ -17,7 +17,6 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 from debug_logger import debug_logger, DebugTimer, log_streamlit_state, log_json_parsing
 # debug_logger.info("Extraction page loaded", context={"page": "extraction_attributs"})  # Debug log commented out
 
-import os
 import time
 import json
 import pandas as pd
@@ -382,10 +381,11 @@ if 'playwright_installed' not in st.session_state:
 
 # --- Imports ---
 import config
-from pdf_processor import process_uploaded_pdfs
+from pdf_processor import run_pdf_coroutine, stream_uploaded_pdfs
 from vector_store import (
     get_embedding_function,
-    setup_vector_store
+    setup_vector_store,
+    setup_vector_store_streaming
 )
 from llm_interface import (
     initialize_llm,
@@ -546,7 +546,11 @@ def reset_evaluation_state():
 @st.cache_resource
 def initialize_embeddings():
     """Initialize embeddings function."""
-    embeddings = get_embedding_function()
+    # Retrieval queries of the extraction stages: attribute names (stages 2/3, rechecks) and PDF instructions (pdf_chain)
+    known_queries = list(prompts_to_run) + [prompts["pdf"] for prompts in prompts_to_run.values()]
+    embeddings = get_embedding_function(known_queries=known_queries)
+    if hasattr(embeddings, "warm"):
+        embeddings.warm()
     return embeddings
 
 @st.cache_resource
@@ -613,6 +617,14 @@ with st.sidebar:
     # --- Add Part Number Input ---
     st.text_input("Enter Part Number (Optional):", key="part_number_input", value=st.session_state.get("part_number_input", ""))
     # ---------------------------
+    extraction_strategies = ["vision", "auto", "text"]
+    extraction_strategy = st.selectbox(
+        "PDF extraction strategy",
+        extraction_strategies,
+        index=extraction_strategies.index(config.PDF_EXTRACTION_STRATEGY) if config.PDF_EXTRACTION_STRATEGY in extraction_strategies else 0,
+        help="vision: OCR every page with Mistral Vision. auto: use the embedded text layer when usable, vision otherwise. text: embedded text layer only.",
+        key="extraction_strategy"
+    )
 
     process_button = st.button("Process Uploaded Documents", key="process_button", type="primary")
 
@@ -636,25 +648,23 @@ with st.sidebar:
             # --- PDF Processing ---
             update_thinking_log("Processing PDFs", f"Processing files: {', '.join(filenames)}", is_active=True, reset_time=True, placeholder=st.session_state['log_placeholder'])
 
-            with st.spinner("Processing PDFs... Loading, cleaning, splitting..."):
+            with st.spinner("Processing PDFs... Extracting and indexing pages as they are ready..."):
                 processed_docs = [] # Initialize as empty list instead of None
+                streamed_retriever = None
+                unindexed_docs = []
                 try:
                     start_time = time.time()
-                    temp_dir = os.path.join(os.getcwd(), "temp_pdf_files")
-                    
-                    # Create event loop for async processing
-                    try:
-                        loop = asyncio.get_event_loop()
-                    except RuntimeError:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
                     
-                    # Call the async function properly
-                    processed_docs = loop.run_until_complete(process_uploaded_pdfs(uploaded_files, temp_dir))
+                    # OCR, embedding and indexing overlap on the shared PDF event loop,
+                    # reusing the bytes already held in session state
+                    streamed_retriever, processed_docs, unindexed_docs = run_pdf_coroutine(setup_vector_store_streaming(
+                        stream_uploaded_pdfs(st.session_state.uploaded_file_data, strategy=extraction_strategy),
+                        embedding_function
+                    ))
                     
                     processing_time = time.time() - start_time
-                    logger.info(f"PDF processing took {processing_time:.2f} seconds.")
-                    update_thinking_log("PDF Processing", f"PDF processing took {processing_time:.2f} seconds.", is_active=True, reset_time=False, placeholder=st.session_state['log_placeholder'])
+                    logger.info(f"PDF processing and indexing took {processing_time:.2f} seconds.")
+                    update_thinking_log("PDF Processing", f"PDF processing and indexing took {processing_time:.2f} seconds.", is_active=True, reset_time=False, placeholder=st.session_state['log_placeholder'])
                 except Exception as e:
                     logger.error(f"Failed during PDF processing phase: {e}", exc_info=True)
                     st.error(f"Error processing PDFs: {e}")
@@ -667,7 +677,18 @@ with st.sidebar:
                 with st.spinner("Indexing documents in vector store..."):
                     try:
                         start_time = time.time()
-                        st.session_state.retriever = setup_vector_store(processed_docs, embedding_function)
+                        # Pages were indexed while streaming; index in one shot only what that could not
+                        if streamed_retriever is None:
+                            st.session_state.retriever = setup_vector_store(processed_docs, embedding_function)
+                        elif unindexed_docs:
+                            logger.warning(f"{len(unindexed_docs)} streamed documents were not indexed, indexing them in one shot")
+                            if setup_vector_store(unindexed_docs, embedding_function) is None:
+                                pages = sorted({(doc.metadata.get('source', ''), doc.metadata.get('page')) for doc in unindexed_docs})
+                                st.warning(f"{len(pages)} page(s) could not be indexed and will not be searched: "
+                                           + ", ".join(f"{source} p.{page}" for source, page in pages))
+                            st.session_state.retriever = streamed_retriever
+                        else:
+                            st.session_state.retriever = streamed_retriever
                         indexing_time = time.time() - start_time
                         logger.info(f"Vector store setup took {indexing_time:.2f} seconds.")
                         update_thinking_log("Vector Store Setup", f"Vector store setup took {indexing_time:.2f} seconds.", is_active=True, reset_time=False, placeholder=st.session_state['log_placeholder'])
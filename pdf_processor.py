@@ -1,23 +1,69 @@
-import os #Crée le répertoire temporaire et gère les fichiers
+import os #Gère les fichiers et les variables d'environnement
 import re#Crée les regex pour identifier les attributs dans le texte extrait
 import base64 #Encode les images pour l'API
 import io # Input/Output streams
 import asyncio#Programmation asynchrone (non-bloquante)
-from concurrent.futures import ThreadPoolExecutor #Traite plusieurs PDFs en parallèle
+import threading # Verrou de rendu partagé entre les pages d'un même PDF
+import hashlib # Empreintes de contenu pour le cache OCR
+import time # Mesures de rendu et d'encodage
+import random # Gigue des délais de nouvelle tentative
+import math # Seuil des lignes répétées sur la plupart des pages
+from email.utils import parsedate_to_datetime # En-tête Retry-After au format date HTTP
+from collections import OrderedDict, deque
+import multiprocessing
+from multiprocessing import shared_memory # Pixels et PDF partagés avec les processus de rendu
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor #Traite plusieurs PDFs en parallèle
 # Imports des modules Python standard pour la gestion des fichiers, expressions régulières, encodage base64, entrées/sorties, programmation asynchrone et exécution parallèle
-from typing import List, BinaryIO, Optional, Dict, Any, Tuple # Types de données pour le typage statique
+from typing import List, BinaryIO, Optional, Dict, Any, Tuple, Union, Callable, AsyncIterator # Types de données pour le typage statique
 from loguru import logger
-from PIL import Image# traitement d'images
+from PIL import Image, ImageChops# traitement d'images
 import fitz  # PyMuPDF , Conversion PDF vers image 
 from mistralai.client import MistralClient
+from mistralai.constants import RETRY_STATUS_CODES
+from mistralai.exceptions import MistralAPIException, MistralException
 from langchain.docstore.document import Document #: Classes LangChain pour les documents et la segmentation de texte
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import json
 import difflib #pour comparer des séquences (comme des chaînes de caractères, des listes, etc.) et calculer leurs différences.
 import config
 
-# Global thread pool for PDF processing
-pdf_thread_pool = ThreadPoolExecutor(max_workers=2)  #traiter les PDFs en parallèle,
+# Global thread pool for the blocking parts of PDF processing (rendering, Mistral SDK calls),
+# shared by every file, page and Streamlit session
+pdf_thread_pool = ThreadPoolExecutor(max_workers=config.PDF_WORKER_THREADS, thread_name_prefix="pdf-worker")  #traiter les PDFs en parallèle,
+
+# Single event loop on which all PDF files and pages are scheduled as tasks
+_pdf_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_pdf_event_loop_lock = threading.Lock()
+
+
+def get_pdf_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared PDF processing event loop, starting its thread on first use."""
+    global _pdf_event_loop
+    with _pdf_event_loop_lock:
+        if _pdf_event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="pdf-event-loop", daemon=True).start()
+            _pdf_event_loop = loop
+            logger.info(f"Started PDF processing event loop ({config.PDF_WORKER_THREADS} worker threads)")
+    return _pdf_event_loop
+
+
+def run_pdf_coroutine(coro):
+    """Run a PDF processing coroutine on the shared event loop from synchronous code and wait for its result."""
+    loop = get_pdf_event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_pdf_coroutine() cannot be called from the PDF event loop itself; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def _run_blocking(func, *args):
+    """Run a blocking function in the shared PDF thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(pdf_thread_pool, func, *args)
+
 # --- Load Attribute Dictionary ---
 ATTRIBUTE_DICTIONARY_PATH = os.getenv("ATTRIBUTE_DICTIONARY_PATH", "attribute_dictionary.json")
 try:
@@ -38,84 +84,166 @@ def build_attribute_regexes(attribute_dict):
             continue
         pattern = r'(' + '|'.join(clean_values) + r')'
         regexes[attr] = re.compile(pattern, re.IGNORECASE) #IGNORECASE : Flag pour ignorer la casse (majuscules/minuscules)
-        # Debug for Contact Systems
-        if attr == "Contact Systems":
-            logger.info(f"Contact Systems regex pattern: {pattern}")
-            logger.info(f"Contact Systems clean values (first 5): {clean_values[:5]}")
     
     return regexes
 
 ATTRIBUTE_REGEXES = build_attribute_regexes(ATTRIBUTE_DICTIONARY)
 
+# Characters that re.IGNORECASE folds onto ASCII letters although str.lower() does not
+_REGEX_ONLY_FOLDS = ("\u0130", "\u0131", "\u017f")  # İ, ı, ſ
+
+
+class AttributeMatcher:
+    """
+    Aho-Corasick automaton over every value of the attribute dictionary.
+
+    Tags a text in a single pass and returns exactly what one case-insensitive
+    alternation regex per attribute (``build_attribute_regexes``) would find:
+    for each attribute, matches are taken left to right without overlap and,
+    at a given position, the value listed first in the dictionary wins.
+    """
+
+    def __init__(self, attribute_dict: Dict[str, List[str]]):
+        self.attributes: List[str] = []
+        self._ascii_values = True
+        self._goto: List[Dict[str, int]] = [{}]
+        # Per state: (attribute index, value index, value length) of every value ending there
+        self._outputs: List[List[Tuple[int, int, int]]] = [[]]
+
+        for attr, values in attribute_dict.items():
+            if not any(values):
+                continue  # Same attributes as build_attribute_regexes
+            attr_index = len(self.attributes)
+            self.attributes.append(attr)
+            for value_index, value in enumerate(values):
+                if not value:
+                    continue
+                self._ascii_values = self._ascii_values and value.isascii()
+                state = 0
+                for char in value.lower():
+                    next_state = self._goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][char] = next_state
+                        self._goto.append({})
+                        self._outputs.append([])
+                    state = next_state
+                self._outputs[state].append((attr_index, value_index, len(value)))
+
+        # Failure links, breadth first
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def _needs_regex(self, text: str) -> bool:
+        """True when lower-casing cannot reproduce re.IGNORECASE on this text."""
+        if text.isascii():
+            return False
+        if not self._ascii_values or len(text.lower()) != len(text):
+            return True
+        return any(char in text for char in _REGEX_ONLY_FOLDS)
+
+    def find(self, text: str) -> List[List[str]]:
+        """Return, per attribute (in ``self.attributes`` order), the matched substrings of ``text``."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        # Best (lowest) value index per (attribute, start position)
+        best: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        state = 0
+        for position, char in enumerate(text.lower()):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for attr_index, value_index, length in outputs[state]:
+                key = (attr_index, position - length + 1)
+                current = best.get(key)
+                if current is None or value_index < current[0]:
+                    best[key] = (value_index, length)
+
+        matches: List[List[str]] = [[] for _ in self.attributes]
+        next_free = [0] * len(self.attributes)
+        for attr_index, start in sorted(best):
+            if start < next_free[attr_index]:
+                continue  # Overlaps the previous match of this attribute
+            length = best[(attr_index, start)][1]
+            matches[attr_index].append(text[start:start + length])
+            next_free[attr_index] = start + length
+        return matches
+
+    def tag(self, text: str) -> Dict[str, Optional[str]]:
+        """Tag a text: attribute -> comma-separated sorted matches, or None when nothing matched."""
+        if self._needs_regex(text):
+            return tag_chunk_with_regexes(text, ATTRIBUTE_REGEXES)
+        tags = {}
+        for attr, found in zip(self.attributes, self.find(text)):
+            match_list = sorted({m.strip() for m in found})
+            tags[attr] = ", ".join(match_list) if match_list else None
+        return tags
+
+
+ATTRIBUTE_MATCHER = AttributeMatcher(ATTRIBUTE_DICTIONARY)
+
+
 # --- Tagging Utility --- #Fonction qui tag un texte avec les attributs trouvés
-def tag_chunk_with_dictionary(chunk_text, attribute_regexes):
+def tag_chunk_with_regexes(chunk_text, attribute_regexes):
+    """Reference tagger: one regex pass per attribute (kept as fallback and for benchmarks)."""
     tags = {}
-    logger.info(f"Tagging chunk with {len(attribute_regexes)} attribute regexes")
-    
-    # Special debugging for Contact Systems
-    if "Contact Systems" in attribute_regexes:
-        contact_regex = attribute_regexes["Contact Systems"]
-        contact_matches = contact_regex.findall(chunk_text)
-        logger.info(f"Contact Systems regex matches: {contact_matches}")
-        logger.info(f"Looking for 'MCP 2.8' in text: {'MCP 2.8' in chunk_text}")
-    
     for attr, regex in attribute_regexes.items():    # regex = regex compilé pour cet attribut
         matches = regex.findall(chunk_text) # Trouve toutes les correspondances dans le texte
         # Convert matches to a list and handle empty lists properly for Chroma metadata
         match_list = sorted({m.strip() for m in matches}) #m.strip() : Supprime les espaces en début/fin de chaque correspondance
 #{...} : Crée un set pour éliminer les doublons
 #sorted(...) : Trie les résultats par ordre alphabétique
-        if match_list:
-            tags[attr] = ", ".join(match_list) #Stockage des résultats
-            logger.info(f"Found matches for '{attr}': {match_list}")
-        else:
-            # If no matches, store as None (Chroma accepts None as metadata value)
-            tags[attr] = None
-            logger.debug(f"No matches found for '{attr}'")
-    
+        # If no matches, store as None (Chroma accepts None as metadata value)
+        tags[attr] = ", ".join(match_list) if match_list else None #Stockage des résultats
+    return tags
+
+
+def tag_chunk_with_dictionary(chunk_text, matcher: Optional[AttributeMatcher] = None):
+    """Tag a text with the attribute dictionary values it contains, in a single pass."""
+    tags = (matcher or ATTRIBUTE_MATCHER).tag(chunk_text)
     # Log summary of what was found
     found_attrs = [attr for attr, value in tags.items() if value is not None]#Filtrage des attributs trouvés
-    logger.info(f"Generated tags for {len(found_attrs)} attributes: {found_attrs}")
-    logger.debug(f"All generated tags: {tags}")
+    logger.debug(f"Generated tags for {len(found_attrs)} attributes: {found_attrs}")
     return tags
 
 
-def encode_pil_image(pil_image: Image.Image, format: str = "PNG") -> Tuple[str, str]: #Tuple contenant (chaîne base64, format d'image)
-    """Encode PIL Image to Base64 string."""
+def encode_pil_image(pil_image: Image.Image, format: str = "PNG", quality: Optional[int] = None) -> Tuple[str, str]: #Tuple contenant (chaîne base64, format d'image)
+    """Encode PIL Image to Base64 string (PNG, JPEG or WEBP; grayscale images stay grayscale)."""
     buffered = io.BytesIO() #Crée un buffer en mémoire pour stocker temporairement l'image
-    # Ensure image is in RGB mode
-    if pil_image.mode == 'RGBA':
-        pil_image = pil_image.convert('RGB')
-    elif pil_image.mode != 'RGB':
+    # Ensure image is in RGB (or grayscale) mode
+    if pil_image.mode not in ('RGB', 'L'):
         pil_image = pil_image.convert('RGB')
 
     save_format = format.upper()
-    if save_format not in ["PNG", "JPEG"]:
+    if save_format == "JPG":
+        save_format = "JPEG"
+    if save_format not in ["PNG", "JPEG", "WEBP"]:
         logger.warning(f"Unsupported format '{format}', defaulting to PNG.")
         save_format = "PNG"
 
-    pil_image.save(buffered, format=save_format)
-    img_byte = buffered.getvalue()# Récupération des données binaires de l'image
-    return base64.b64encode(img_byte).decode('utf-8'), save_format.lower()#Convertit les bytes en base64
+    save_kwargs = {}
+    if save_format in ("JPEG", "WEBP") and quality is not None:
+        save_kwargs["quality"] = quality
+    pil_image.save(buffered, format=save_format, **save_kwargs)
+    # Encode straight from the buffer (getvalue() would add one more copy of the image bytes)
+    with buffered.getbuffer() as img_byte:# Récupération des données binaires de l'image
+        encoded = base64.b64encode(img_byte)
+    buffered.close()
+    return encoded.decode('ascii'), save_format.lower()#Convertit les bytes en base64
 #On peut ensuite encoder ces bytes(binaire) en base64[ascii], les envoyer à une AP
-async def process_single_pdf(file_path: str, file_basename: str, client: MistralClient, model_name: str) -> List[Document]:
-    """Process a single PDF file and return its documents."""
-    all_docs = []
-    total_pages_processed = 0
-    pdf_document = None
-    
-    try:
-        logger.info(f"Starting processing of PDF: {file_basename}")
-        logger.debug(f"File path: {file_path}")
-        logger.debug(f"Using model: {model_name}")
-        
-        # Open PDF with PyMuPDF
-        pdf_document = fitz.open(file_path)
-        total_pages = len(pdf_document)#Comptage des pages totales
-        logger.info(f"Successfully opened PDF with {total_pages} pages")
-        
-        # Define the prompt for Mistral Vision
-        markdown_prompt = """
+
+
+# Define the prompt for Mistral Vision
+MARKDOWN_PROMPT = """
 You are an expert document analysis assistant. Extract ALL text content from the image and format it as clean, well-structured GitHub Flavored Markdown.
 
 Follow these formatting instructions:
@@ -133,88 +261,1672 @@ Output only the generated Markdown content.
 #Instructions précises pour Mistral Vision
 # Formatage en Markdown structuré
 # Extraction complète de tout le texte visible
-        for page_num in range(total_pages):
-            logger.info(f"\n{'='*50}") # Crée une ligne de 50 caractères "
-            logger.info(f"Processing page {page_num + 1}/{total_pages} of {file_basename}")# Numéro de page (commence à 1, pas 0),Nombre total de pages
-            logger.debug(f"Page dimensions: {pdf_document[page_num].rect}")
-            logger.info(f"{'='*50}\n")
-            
+# Bump whenever MARKDOWN_PROMPT changes so that cached OCR results are not reused
+MARKDOWN_PROMPT_VERSION = "1"
+
+# Added to MARKDOWN_PROMPT when several page images are packed into one request
+PACKED_PAGES_PROMPT = """
+The {count} images are consecutive pages of one document. Transcribe each image separately and in order.
+Start the transcription of image k with a line containing only <<<PAGE k>>> (from <<<PAGE 1>>> to <<<PAGE {count}>>>),
+even when the image contains no text.
+"""
+_PACKED_PAGE_DELIMITER = re.compile(r"^[ \t]*<<<PAGE (\d+)>>>[ \t]*$", re.MULTILINE)
+
+
+# --- OCR Result Cache ---
+class OCRPageCache:
+    """
+    Persistent, content-addressed cache of vision OCR results (one markdown file per page).
+    Entries are evicted least-recently-used first once the cache exceeds ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild the LRU order from the access times left on disk
+        existing = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".md"):
+                continue
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            existing.append((stat.st_mtime, name[:-3], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._total_bytes += size
+        logger.info(f"OCR cache at '{cache_dir}': {len(self._entries)} entries, {self._total_bytes / 1e6:.1f} MB")
+
+    @staticmethod
+    def make_key(file_hash: str, page_index: int, model_name: str, prompt_version: str = MARKDOWN_PROMPT_VERSION) -> str:
+        """Build the cache key of one page of one PDF for a given model and prompt version."""
+        raw = f"{file_hash}|{page_index}|{model_name}|{prompt_version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.md")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached markdown for ``key`` or None, counting the hit or miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                os.utime(path)  # Record the access for LRU ordering across restarts
+            except OSError as e:
+                logger.warning(f"Could not read OCR cache entry {key}: {e}")
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key: str, content: str) -> None:
+        """Store the markdown for ``key`` and evict old entries above the size cap."""
+        data = content.encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
             try:
-                # Get the page
-                page = pdf_document[page_num]
-                
-                # Convert page to image with higher resolution
-                logger.debug("Converting page to high-resolution image...")#Conversion en pixels haute résolution (300 DPI)
-                pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)#Création d'image PIL depuis les pixels
-                logger.debug(f"Image created with dimensions: {img.size}")
-                
-                # Encode image to base64
-                logger.debug("Encoding image to base64...")
-                base64_image, image_format = encode_pil_image(img)
-                logger.debug(f"Image encoded in {image_format} format")
-                
-                # Prepare message for Mistral Vision
-                messages = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": markdown_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": f"data:image/{image_format};base64,{base64_image}"
-                            }
-                        ]
-                    }
-                ]
-                
-                # Call Mistral Vision API
-                logger.info("Sending page to Mistral Vision API...")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)  # Atomic: readers never see a partial entry
+            except OSError as e:
+                logger.warning(f"Could not write OCR cache entry {key}: {e}")
+                return
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
                 try:
-                    chat_response = client.chat(
-                        model=model_name,
-                        messages=messages#: Structure préparée avec prompt + image
-                    )
-                    logger.debug("Successfully received response from Mistral Vision API")
-                except Exception as api_error:
-                    logger.error(f"Mistral Vision API error: {str(api_error)}")
-                    raise
-                
-                # Get extracted text
-                page_content = chat_response.choices[0].message.content
-                
-                if page_content:
-                    # --- Tag the chunk with dictionary matches ---
-                    chunk_tags = tag_chunk_with_dictionary(page_content, ATTRIBUTE_REGEXES)#Marquage avec les attributs
-                    # Log the extracted content
-                    logger.info("\nExtracted Content:")
-                    logger.debug("-" * 40)
-                    logger.debug(page_content)
-                    logger.debug("-" * 40)
-                    
-                    # Instead of splitting into chunks, treat the whole page as one document
-                    chunk_doc = Document(#pour l'intégration avec les systèmes de recherche vectorielle)
-                        page_content=page_content,
-                        metadata={
-                            'source': file_basename,
-                            'page': page_num + 1,
-                            **chunk_tags  # Add all attribute tags to metadata
-                        }
-                    )
-                    all_docs.append(chunk_doc)
-                    logger.debug(f"Created document for page {page_num + 1}")# Compteur de pages traitées avec succès
-                    
-                    logger.success(f"Successfully processed page {page_num + 1} from {file_basename}")#confirmation  Compteur de pages traitées avec succès
-                    total_pages_processed += 1
-                else:
-                    logger.warning(f"No content extracted from page {page_num + 1} of {file_basename}")
-                    
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+                logger.debug(f"Evicted OCR cache entry {old_key}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+_ocr_cache: Optional[OCRPageCache] = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> Optional[OCRPageCache]:
+    """Return the process-wide OCR cache, or None when caching is disabled."""
+    global _ocr_cache
+    if not config.OCR_CACHE_ENABLED:
+        return None
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            try:
+                _ocr_cache = OCRPageCache(config.OCR_CACHE_DIR, config.OCR_CACHE_MAX_MB * 1024 * 1024)
+            except OSError as e:
+                logger.warning(f"OCR cache disabled, could not open '{config.OCR_CACHE_DIR}': {e}")
+                return None
+    return _ocr_cache
+
+
+def hash_pdf_file(file_path: str) -> str:
+    """Return the sha256 hex digest of a PDF file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Vision Rate Limiting ---
+class VisionRateLimiter:
+    """
+    Process-wide scheduler for Mistral Vision calls, shared by all files and users.
+
+    A token bucket caps the request rate and an AIMD window caps the calls in flight:
+    each success widens the window by 1/window (about one slot per round trip) and
+    raises the rate back towards its maximum; a 429 halves both and pauses every
+    caller for the Retry-After delay. State is behind a threading lock and waiting
+    is done with asyncio.sleep, so callers on any event loop can share it.
+    """
+
+    def __init__(self, max_rate: float, burst: int, max_concurrency: int, min_rate: float = 0.1):
+        self.max_rate = max(min_rate, max_rate)
+        self.min_rate = min_rate
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.window = float(self.max_concurrency)
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttle_events = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _try_acquire(self) -> float:
+        """Take a slot and a token if possible; otherwise return how long to wait before trying again."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= int(self.window):
+            return 0.05
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._in_flight += 1
+        self.requests += 1
+        return 0.0
+
+    async def acquire(self) -> None:
+        """Wait for permission to send one request; pair every call with release()."""
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire()
+                if wait <= 0:
+                    return
+                await asyncio.sleep(min(wait, 1.0))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None, succeeded: bool = True) -> None:
+        """Return a slot: additive increase after a success, multiplicative decrease after a 429.
+
+        Other failures and cancelled calls (``succeeded=False``) leave the window and rate as they are.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if throttled:
+                self.throttle_events += 1
+                self.window = max(1.0, self.window / 2)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, 0.0)
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                logger.warning(f"Vision API throttled: window {self.window:.1f}, rate {self.rate:.2f} req/s"
+                               + (f", paused {retry_after:.1f} s" if retry_after else ""))
+            elif succeeded:
+                self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "window": round(self.window, 2),
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "requests": self.requests,
+                "throttle_events": self.throttle_events,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+
+_vision_rate_limiter: Optional[VisionRateLimiter] = None
+_vision_rate_limiter_lock = threading.Lock()
+
+
+def get_vision_rate_limiter() -> VisionRateLimiter:
+    """Return the process-wide vision rate limiter."""
+    global _vision_rate_limiter
+    with _vision_rate_limiter_lock:
+        if _vision_rate_limiter is None:
+            _vision_rate_limiter = VisionRateLimiter(config.VISION_RATE_LIMIT_RPS, config.VISION_RATE_BURST,
+                                                     config.VISION_MAX_IN_FLIGHT)
+    return _vision_rate_limiter
+
+
+def _is_retryable_vision_error(error: Exception) -> bool:
+    """429/5xx responses, connection errors and timeouts are retried; other API errors are not."""
+    if isinstance(error, MistralAPIException):
+        return error.http_status in RETRY_STATUS_CODES
+    return isinstance(error, MistralException)
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Parse the Retry-After header (seconds or HTTP date) of an API error, if any."""
+    headers = getattr(error, "headers", None) or {}
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Pipeline Metrics ---
+PAGE_TIMING_FIELDS = ("render_ms", "encode_ms", "api_ms", "tag_ms", "total_ms")
+PAGE_TOTAL_FIELDS = ("payload_bytes", "output_chars", "boilerplate_chars", "prompt_tokens", "output_tokens",
+                     "api_calls", "chunks")
+
+
+class PipelineMetrics:
+    """JSON-lines sink for the per-page, per-file and per-batch measurement records of the PDF pipeline.
+
+    Records are written in order by a dedicated writer thread, so emit() never blocks the PDF
+    event loop on file I/O; flush() waits for the records emitted so far.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-metrics")
+        self._last_write: Optional[Future] = None
+
+    def _write(self, line: str) -> None:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write pipeline metrics to {self.path}: {e}")
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self._last_write = self._writer.submit(self._write, json.dumps(record, ensure_ascii=False, default=str))
+
+    def flush(self) -> None:
+        last_write = self._last_write
+        if last_write is not None:
+            last_write.result()
+
+
+_pipeline_metrics: Optional[PipelineMetrics] = None
+_pipeline_metrics_lock = threading.Lock()
+
+
+def get_pipeline_metrics() -> Optional[PipelineMetrics]:
+    """Return the process-wide metrics sink, or None when PDF_METRICS_PATH is empty."""
+    global _pipeline_metrics
+    if not config.PDF_METRICS_PATH:
+        return None
+    with _pipeline_metrics_lock:
+        if _pipeline_metrics is None:
+            _pipeline_metrics = PipelineMetrics(config.PDF_METRICS_PATH)
+    return _pipeline_metrics
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def summarise_page_metrics(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate page records: counts per outcome/method, totals, and p50/p95/max of the timings."""
+    summary: Dict[str, Any] = {"pages": len(records)}
+    for key in ("outcome", "extraction_method", "cache"):
+        counts: Dict[str, int] = {}
+        for record in records:
+            if record.get(key) is not None:
+                counts[record[key]] = counts.get(record[key], 0) + 1
+        summary[key] = counts
+    for field in PAGE_TOTAL_FIELDS:
+        summary[field] = sum(record.get(field) or 0 for record in records)
+    for field in PAGE_TIMING_FIELDS:
+        values = sorted(record[field] for record in records if record.get(field) is not None)
+        if values:
+            summary[field] = {"total": round(sum(values)), "p50": round(_percentile(values, 0.5)),
+                              "p95": round(_percentile(values, 0.95)), "max": round(values[-1])}
+    return summary
+
+
+def _format_metrics_summary(summary: Dict[str, Any]) -> str:
+    timings = ", ".join(f"{field[:-3]} p50/p95 {summary[field]['p50']}/{summary[field]['p95']} ms"
+                        for field in PAGE_TIMING_FIELDS if field in summary)
+    return (f"{summary['pages']} pages {summary['outcome']}, {timings}; payload {summary['payload_bytes'] / 1e6:.2f} MB, "
+            f"output {summary['output_chars']} chars / {summary['output_tokens']} tokens, cache {summary['cache']}")
+
+
+# --- Page Checkpoints ---
+class PageCheckpoint:
+    """
+    Append-only manifest of the completed pages of one PDF for one model, extraction strategy
+    and prompt version, so an interrupted ingest (API failure, Streamlit rerun) only processes
+    the missing pages. The strategy is part of the key: pages a "text" or "auto" run took from
+    the text layer must still be OCR'd by a "vision" run.
+    One JSON line per page; a line cut short by a crash is ignored on reload.
+    """
+
+    def __init__(self, checkpoint_dir: str, file_hash: str, model_name: str, strategy: str,
+                 prompt_version: str = MARKDOWN_PROMPT_VERSION):
+        raw = f"{file_hash}|{model_name}|{strategy}|{prompt_version}"
+        self.path = os.path.join(checkpoint_dir, f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()}.jsonl")
+        self.pages: Dict[int, Tuple[str, str]] = {}  # page index -> (content, extraction method)
+        self._lock = threading.Lock()
+        self._file = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.pages[int(entry["page"])] = (entry["content"], entry["method"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Header line or a partial write
+        else:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"file_hash": file_hash, "model": model_name, "strategy": strategy,
+                                    "prompt_version": prompt_version}) + "\n")
+
+    def record(self, page_index: int, content: str, extraction_method: str) -> None:
+        """Append a completed page to the manifest."""
+        line = json.dumps({"page": page_index, "content": content, "method": extraction_method}, ensure_ascii=False)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+            except OSError as e:
+                logger.warning(f"Could not write page checkpoint {self.path}: {e}")
+                return
+            self.pages[page_index] = (content, extraction_method)
+
+    def close(self, completed: bool = False) -> None:
+        """Close the manifest; a completed one is deleted (the OCR cache serves later runs)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if completed:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+
+
+# --- Render Policy ---
+# Bytes held per bitmap byte while a page is rendered and encoded: pixmap, PIL image, encoder output, base64
+RENDER_MEMORY_FACTOR = 2.5
+
+
+def choose_render_dpi(page_rect) -> float:
+    """Pick the render DPI of a page: PDF_RENDER_MAX_DPI, lowered so the bitmap fits PDF_RENDER_PIXEL_BUDGET.
+
+    The memory budget wins over PDF_RENDER_MIN_DPI: a page that would not fit in
+    PDF_RENDER_MEMORY_BUDGET_MB even at the minimum DPI is downscaled further.
+    """
+    dpi = float(config.PDF_RENDER_MAX_DPI)
+    page_sq_inches = (page_rect.width / 72) * (page_rect.height / 72)
+    if config.PDF_RENDER_PIXEL_BUDGET > 0 and page_sq_inches > 0:
+        dpi = min(dpi, (config.PDF_RENDER_PIXEL_BUDGET / page_sq_inches) ** 0.5)
+    dpi = max(float(config.PDF_RENDER_MIN_DPI), dpi)
+    if config.PDF_RENDER_MEMORY_BUDGET_MB > 0 and page_sq_inches > 0:
+        max_pixels = config.PDF_RENDER_MEMORY_BUDGET_MB * 1024 * 1024 / (3 * RENDER_MEMORY_FACTOR)
+        memory_dpi = (max_pixels / page_sq_inches) ** 0.5
+        if memory_dpi < dpi:
+            logger.debug(f"Page of {page_rect.width / 72:.0f}x{page_rect.height / 72:.0f} in downscaled to "
+                         f"{memory_dpi:.0f} DPI to fit the render memory budget")
+            dpi = memory_dpi
+    return dpi
+
+
+def estimate_render_bytes(page_rect) -> int:
+    """Upper bound of the memory used to render and encode a page (RGB at the chosen DPI)."""
+    dpi = choose_render_dpi(page_rect)
+    pixels = (page_rect.width / 72 * dpi) * (page_rect.height / 72 * dpi)
+    return int(pixels * 3 * RENDER_MEMORY_FACTOR)
+
+
+class RenderMemoryBudget:
+    """
+    Process-wide byte budget shared by concurrent page rasterisations. A render waits until
+    its estimate fits next to the ones in progress; a render larger than the whole budget
+    runs alone rather than never. A ``max_bytes`` of 0 means unlimited (only peak use is tracked).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    def _must_wait(self, nbytes: int) -> bool:
+        return self.max_bytes > 0 and self.in_use > 0 and self.in_use + nbytes > self.max_bytes
+
+    def acquire(self, nbytes: int) -> None:
+        with self._condition:
+            if self._must_wait(nbytes):
+                self.waits += 1
+            while self._must_wait(nbytes):
+                self._condition.wait()
+            self.in_use += nbytes
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+
+render_memory_budget = RenderMemoryBudget(max(0, config.PDF_RENDER_MEMORY_BUDGET_MB) * 1024 * 1024)
+
+
+def read_rss_bytes() -> int:
+    """Current resident set size of this process (Linux /proc; peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return 0
+
+
+class PeakRSSMonitor:
+    """Sample the process RSS in a background thread to report the peak of one ingest."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak_bytes = read_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, read_rss_bytes())
+
+    def start(self) -> "PeakRSSMonitor":
+        self._thread.start()
+        return self
+
+    def stop(self) -> int:
+        """Stop sampling and return the peak RSS in bytes."""
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, read_rss_bytes())
+        return self.peak_bytes
+
+    def __enter__(self) -> "PeakRSSMonitor":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def is_monochrome_page(page, tolerance: int = 8) -> bool:
+    """Check on a small thumbnail whether a page only contains shades of grey."""
+    thumb = page.get_pixmap(matrix=fitz.Matrix(0.25, 0.25), alpha=False)
+    if thumb.n < 3:
+        return True
+    red, green, blue = Image.frombytes("RGB", [thumb.width, thumb.height], thumb.samples).split()
+    return (ImageChops.difference(red, green).getextrema()[1] <= tolerance
+            and ImageChops.difference(green, blue).getextrema()[1] <= tolerance)
+
+
+def _render_pixmap(page) -> Tuple["fitz.Pixmap", float, str]:
+    """Rasterise a page following the render policy; returns the pixmap, the DPI used and the PIL mode."""
+    dpi = choose_render_dpi(page.rect)
+    grayscale = config.PDF_RENDER_GRAYSCALE and is_monochrome_page(page)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=colorspace, alpha=False)
+    return pix, dpi, "L" if grayscale else "RGB"
+
+
+def render_page_image(page) -> Tuple[Image.Image, float]:
+    """Render a page following the render policy; returns the PIL image and the DPI used."""
+    pix, dpi, mode = _render_pixmap(page)
+    # samples_mv is a view of the pixmap (samples would copy it); the pixmap is freed as soon as PIL has its copy
+    img = Image.frombytes(mode, [pix.width, pix.height], pix.samples_mv)#Création d'image PIL depuis les pixels
+    del pix
+    return img, dpi
+
+
+# --- Process-Pool Rasterisation ---
+# PyMuPDF rendering holds the GIL, so with PDF_RENDER_PROCESSES > 0 pages are rasterised in
+# worker processes. The PDF bytes go to the workers, and the pixels come back, through shared
+# memory instead of being pickled; PNG/JPEG/WEBP encoding stays in the threads (Pillow releases
+# the GIL while compressing).
+_render_process_pool: Optional[ProcessPoolExecutor] = None
+_render_process_pool_lock = threading.Lock()
+
+
+def get_render_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the shared rasterisation process pool, or None when PDF_RENDER_PROCESSES is 0."""
+    global _render_process_pool
+    if config.PDF_RENDER_PROCESSES <= 0:
+        return None
+    with _render_process_pool_lock:
+        if _render_process_pool is None:
+            _render_process_pool = ProcessPoolExecutor(
+                max_workers=config.PDF_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),  # Never fork a process running threads
+            )
+            logger.info(f"Started rasterisation process pool with {config.PDF_RENDER_PROCESSES} workers")
+    return _render_process_pool
+
+
+class _SharedPdf:
+    """The bytes of one PDF placed in a shared memory segment for the rasterisation workers."""
+
+    def __init__(self, pdf_bytes: bytes):
+        self.size = len(pdf_bytes)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, self.size))
+        self._shm.buf[:self.size] = pdf_bytes
+        self.name = self._shm.name
+
+    def close(self) -> None:
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except (OSError, BufferError) as e:
+            logger.warning(f"Could not release shared PDF segment {self.name}: {e}")
+
+
+# Worker-process side: recently used documents, so a PDF is opened once per worker
+_worker_documents: "OrderedDict[str, Tuple[shared_memory.SharedMemory, Any]]" = OrderedDict()
+
+
+def _worker_document(pdf_shm_name: str, pdf_size: int):
+    if pdf_shm_name in _worker_documents:
+        _worker_documents.move_to_end(pdf_shm_name)
+        return _worker_documents[pdf_shm_name][1]
+    shm = shared_memory.SharedMemory(name=pdf_shm_name)
+    document = fitz.open(stream=bytes(shm.buf[:pdf_size]), filetype="pdf")
+    _worker_documents[pdf_shm_name] = (shm, document)
+    while len(_worker_documents) > 4:
+        _, (old_shm, old_document) = _worker_documents.popitem(last=False)
+        old_document.close()
+        old_shm.close()
+    return document
+
+
+def _rasterise_page_to_shm(pdf_shm_name: str, pdf_size: int, page_num: int) -> Dict[str, Any]:
+    """Worker process: render one page into a new shared memory segment and describe it."""
+    start = time.perf_counter()
+    page = _worker_document(pdf_shm_name, pdf_size)[page_num]
+    pix, dpi, mode = _render_pixmap(page)
+    samples = pix.samples_mv
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(samples)))
+    # Workers share the parent's resource tracker, which unregisters the segment when the parent unlinks it
+    shm.buf[:len(samples)] = samples
+    result = {
+        "shm_name": shm.name,
+        "size": len(samples),
+        "width": pix.width,
+        "height": pix.height,
+        "mode": mode,
+        "dpi": dpi,
+        "raster_ms": (time.perf_counter() - start) * 1000,
+    }
+    del samples, pix
+    shm.close()
+    return result
+
+
+def render_page_in_process(pool: ProcessPoolExecutor, shared_pdf: _SharedPdf, page_num: int) -> Tuple[Image.Image, float]:
+    """Rasterise a page in the process pool and read its pixels back from shared memory (blocking)."""
+    result = pool.submit(_rasterise_page_to_shm, shared_pdf.name, shared_pdf.size, page_num).result()
+    shm = shared_memory.SharedMemory(name=result["shm_name"])
+    try:
+        img = Image.frombytes(result["mode"], (result["width"], result["height"]), shm.buf[:result["size"]])
+    finally:
+        shm.close()
+        shm.unlink()
+    return img, result["dpi"]
+
+
+# --- Duplicate Page Detection ---
+# Supplier packs repeat pages (revision copies, cover sheets, legal pages). Within one batch a page
+# whose rendering is pixel-identical to an already claimed page, or whose non-empty text layer and
+# size are the same, reuses that page's OCR result. Near-duplicates are not merged: scanned pages
+# from one template differ only in a few small values, which a perceptual hash cannot see.
+DEDUP_RENDER_SCALE = 1.0  # 72 dpi grayscale rendering hashed for the pixel key
+
+
+def page_fingerprint(page) -> Tuple[str, Optional[str]]:
+    """Return the hash of the page's grayscale rendering and a key of its size and embedded text
+    (None when the page has no text layer)."""
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(DEDUP_RENDER_SCALE, DEDUP_RENDER_SCALE), colorspace=fitz.csGRAY, alpha=False)
+    size = f"{page.rect.width:.0f}x{page.rect.height:.0f}"
+    render_key = f"{size}:{pixmap.width}x{pixmap.height}:{hashlib.sha1(pixmap.samples).hexdigest()}"
+    text = " ".join(page.get_text("text").split())
+    text_key = f"{size}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}" if text else None
+    return render_key, text_key
+
+
+class PageDeduplicator:
+    """Batch-wide registry of page fingerprints; the first page of a group is OCR'd, its copies wait for it.
+
+    Only used from the PDF event loop, so it needs no locking.
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, Tuple["asyncio.Future[Optional[str]]", str]] = {}
+        self.duplicates = 0
+
+    def claim(self, fingerprint: Tuple[str, Optional[str]], page_ref: str) -> Tuple["asyncio.Future[Optional[str]]", str, bool]:
+        """Return the future holding the group's OCR result, the reference of its first page and
+        whether the caller is that first page (and so must resolve the future)."""
+        keys = [f"render:{fingerprint[0]}"] + ([f"text:{fingerprint[1]}"] if fingerprint[1] else [])
+        for key in keys:
+            if key in self._groups:
+                self.duplicates += 1
+                future, leader_ref = self._groups[key]
+                return future, leader_ref, False
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._groups[key] = (future, page_ref)
+        return future, page_ref, True
+
+    @staticmethod
+    def resolve(future: "asyncio.Future[Optional[str]]", page_content: Optional[str]) -> None:
+        if not future.done():
+            future.set_result(page_content)
+
+
+# --- Local Table Extraction ---
+# Spec tables of born-digital pages are rebuilt from the text layer as GitHub Flavored Markdown,
+# in the layout the vision prompt asks for, so "auto" pages need no vision round trip.
+def _markdown_cell(value: Any) -> str:
+    return " ".join(str(value).split()).replace("|", "\\|") if value is not None else ""
+
+
+def table_to_markdown(rows: List[List[Any]]) -> str:
+    """Format extracted table rows as a GFM table, the first row being the header."""
+    width = max(len(row) for row in rows)
+    lines = []
+    for index, row in enumerate(rows):
+        cells = [_markdown_cell(cell) for cell in row] + [""] * (width - len(row))
+        lines.append("| " + " | ".join(cells) + " |")
+        if index == 0:
+            lines.append("|" + "|".join(["---"] * width) + "|")
+    return "\n".join(lines)
+
+
+def _is_usable_table(rows: List[List[Any]]) -> bool:
+    """At least 2x2 and mostly filled; sparse grids are usually drawing frames, not tables."""
+    if len(rows) < 2 or max((len(row) for row in rows), default=0) < 2:
+        return False
+    cells = [cell for row in rows for cell in row]
+    filled = sum(1 for cell in cells if cell is not None and str(cell).strip())
+    return filled / len(cells) >= config.PDF_TABLE_MIN_FILL_RATIO
+
+
+def _count_rulings(page, limit: int) -> int:
+    """Count horizontal/vertical line segments and rectangles (table rulings), stopping at ``limit``."""
+    count = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "re" or (item[0] == "l" and (abs(item[1].x - item[2].x) < 1 or abs(item[1].y - item[2].y) < 1)):
+                count += 1
+                if count >= limit:
+                    return count
+    return count
+
+
+def extract_page_markdown(page) -> Tuple[str, int, bool]:
+    """Build the markdown of a born-digital page: text blocks as paragraphs, detected tables as GFM tables.
+
+    Returns the markdown, the number of tables emitted and whether table detection failed
+    (a detected table could not be read, or the page is ruled like a table but none was found).
+    """
+    try:
+        tables = page.find_tables().tables
+    except Exception as e:
+        logger.debug(f"Table detection failed on page {page.number + 1}: {e}")
+        return "", 0, True
+
+    parts: List[Tuple[float, float, str]] = []
+    table_rects = []
+    failed = False
+    for table in tables:
+        rows = table.extract()
+        if _is_usable_table(rows):
+            rect = fitz.Rect(table.bbox)
+            table_rects.append(rect)
+            parts.append((rect.y0, rect.x0, table_to_markdown(rows)))
+        else:
+            failed = True
+    if not table_rects and config.PDF_TABLE_MIN_RULINGS > 0:
+        failed = failed or _count_rulings(page, config.PDF_TABLE_MIN_RULINGS) >= config.PDF_TABLE_MIN_RULINGS
+
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=True):
+        text = text.strip()
+        if block_type != 0 or not text:
+            continue
+        block = fitz.Rect(x0, y0, x1, y1)
+        if any(abs(block & rect) > 0.5 * abs(block) for rect in table_rects):
+            continue  # Already part of a table
+        parts.append((y0, x0, text))
+    parts.sort(key=lambda part: (part[0], part[1]))
+    return "\n\n".join(part[2] for part in parts), len(table_rects), failed
+
+
+# --- Structure-Aware Chunking ---
+_HEADING_LINE = re.compile(r"^#{1,6}\s")
+
+
+def _markdown_blocks(markdown: str) -> List[Tuple[str, str]]:
+    """Split page markdown into ("heading" | "table" | "text", block) pieces, tables kept whole."""
+    blocks: List[Tuple[str, str]] = []
+    kind, lines = None, []
+
+    def flush():
+        if lines and "".join(lines).strip():
+            blocks.append((kind, "\n".join(lines).strip("\n")))
+        lines.clear()
+
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if _HEADING_LINE.match(stripped):
+            flush()
+            kind = "heading"
+            lines.append(stripped)
+            flush()
+            kind = None
+        elif stripped.startswith("|"):
+            if kind != "table":
+                flush()
+                kind = "table"
+            lines.append(stripped)
+        elif not stripped:
+            if kind != "table":
+                flush()
+                kind = None
+        else:
+            if kind == "table":
+                flush()
+            kind = "text"
+            lines.append(line)
+    flush()
+    return blocks
+
+
+def _split_oversized_block(kind: str, block: str, max_chars: int) -> List[str]:
+    """Split a block longer than ``max_chars``: tables by rows (repeating the header), text recursively."""
+    if kind == "table":
+        rows = block.split("\n")
+        header = rows[:2] if len(rows) > 2 and set(rows[1].replace("|", "").strip()) <= set("-: ") else rows[:1]
+        pieces, current = [], list(header)
+        for row in rows[len(header):]:
+            if len("\n".join(current + [row])) > max_chars and len(current) > len(header):
+                pieces.append("\n".join(current))
+                current = list(header)
+            current.append(row)
+        pieces.append("\n".join(current))
+        return pieces
+    splitter = RecursiveCharacterTextSplitter(chunk_size=max_chars, chunk_overlap=config.CHUNK_OVERLAP)
+    return splitter.split_text(block)
+
+
+def split_page_markdown(markdown: str, max_chars: Optional[int] = None) -> List[str]:
+    """Split the markdown of one page into chunks of at most ``max_chars`` characters.
+
+    A heading starts a new chunk, tables are never cut between rows of different pieces
+    without their header, and a chunk that does not start with a heading repeats the
+    heading of its section for context.
+    """
+    max_chars = max_chars or config.CHUNK_SIZE
+    if len(markdown) <= max_chars:
+        return [markdown]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    section_heading = ""
+
+    def flush():
+        body = "\n\n".join(current).strip()
+        if body and body != section_heading:
+            if section_heading and not _HEADING_LINE.match(body):
+                body = f"{section_heading}\n\n{body}"
+            chunks.append(body)
+        current.clear()
+
+    for kind, block in _markdown_blocks(markdown):
+        if kind == "heading":
+            flush()
+            section_heading = block
+            current.append(block)
+            continue
+        # Room left once the section heading is repeated in front of a continuation chunk
+        room = max(max_chars - len(section_heading) - 2, max_chars // 2) if section_heading else max_chars
+        pieces = [block] if len(block) <= room else _split_oversized_block(kind, block, room)
+        for piece in pieces:
+            if current and len("\n\n".join(current)) + len(piece) + 2 > room:
+                flush()
+            current.append(piece)
+    flush()
+    return chunks or [markdown]
+
+
+# --- Boilerplate Removal ---
+_BOILERPLATE_MARKUP = re.compile(r"[#*_`>|~\[\]()!:\-]+")
+# "Page 3 of 12", "Seite 3/12", "Sheet 3": the only numbers that differ in a repeated footer
+_PAGE_NUMBER = re.compile(r"\b(page|pages|seite|sheet|blatt|pg)\.?\s*\d+(\s*(of|/|von|sur|de)\s*\d+)?", re.IGNORECASE)
+BOILERPLATE_MAX_LINE_CHARS = 200  # Longer lines are content, even when repeated
+BOILERPLATE_MIN_VALUE_CHARS = 3  # Shorter dictionary values (coding letters, digits) match almost any line
+
+
+def _carries_attribute_value(line: str) -> bool:
+    """True when a line contains a dictionary value as a whole word ("**Housing material:** PA66 GF30").
+
+    Such lines are spec values that apply to the whole document, so they are never boilerplate.
+    """
+    for found in ATTRIBUTE_MATCHER.find(line):
+        for match in found:
+            if len(match) >= BOILERPLATE_MIN_VALUE_CHARS and re.search(rf"(?<!\w){re.escape(match)}(?!\w)", line):
+                return True
+    return False
+
+
+def _boilerplate_key(line: str) -> Optional[str]:
+    """Normalise a markdown line for cross-page comparison (markup, case and page numbers ignored).
+
+    Returns None for lines that never count as boilerplate (blank, separators, numbers only, long lines).
+    """
+    key = _BOILERPLATE_MARKUP.sub(" ", _PAGE_NUMBER.sub("page #", line))
+    key = " ".join(key.lower().split())
+    if not key or len(key) > BOILERPLATE_MAX_LINE_CHARS or not any(ch.isalpha() for ch in key):
+        return None
+    return key
+
+
+def find_boilerplate_lines(pages: List[str]) -> Dict[str, str]:
+    """Return the lines found on most pages of a document (title blocks, footers, navigation links).
+
+    A line is boilerplate when it appears on at least PDF_BOILERPLATE_MIN_PAGE_RATIO of the
+    pages and on at least PDF_BOILERPLATE_MIN_PAGES pages, and carries no attribute dictionary
+    value. Maps the normalised line to its first occurrence.
+    """
+    if len(pages) < config.PDF_BOILERPLATE_MIN_PAGES:
+        return {}
+    threshold = max(config.PDF_BOILERPLATE_MIN_PAGES, math.ceil(config.PDF_BOILERPLATE_MIN_PAGE_RATIO * len(pages)))
+    page_counts: Dict[str, int] = {}
+    originals: Dict[str, str] = {}
+    for page in pages:
+        for key in {_boilerplate_key(line) for line in page.split("\n")} - {None}:
+            page_counts[key] = page_counts.get(key, 0) + 1
+        for line in page.split("\n"):
+            key = _boilerplate_key(line)
+            if key is not None and key not in originals:
+                originals[key] = line.strip()
+    return {key: line for key, line in originals.items()
+            if page_counts[key] >= threshold and not _carries_attribute_value(line)}
+
+
+def strip_boilerplate(markdown: str, boilerplate: Dict[str, str], removed: Optional[set] = None) -> str:
+    """Remove boilerplate lines from a page; the keys of the removed lines are added to ``removed``.
+
+    A table is removed only when all of its rows are boilerplate (a repeated revision
+    table); tables whose header alone repeats across pages are kept whole.
+    """
+    lines = markdown.split("\n")
+    kept: List[str] = []
+    i = 0
+    while i < len(lines):
+        if lines[i].lstrip().startswith("|"):
+            end = i
+            while end < len(lines) and lines[end].lstrip().startswith("|"):
+                end += 1
+            keys = [_boilerplate_key(line) for line in lines[i:end]]
+            if not all(key is None or key in boilerplate for key in keys) or all(key is None for key in keys):
+                kept.extend(lines[i:end])
+            elif removed is not None:
+                removed.update(key for key in keys if key is not None)
+            i = end
+            continue
+        key = _boilerplate_key(lines[i])
+        if key is None or key not in boilerplate:
+            kept.append(lines[i])
+        elif removed is not None:
+            removed.add(key)
+        i += 1
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+
+
+# --- Page Prioritisation ---
+def score_page(page) -> float:
+    """Cheap estimate of how likely a page holds attribute values (higher is better).
+
+    Uses the text layer only (no rendering): dictionary keywords, table rulings and drawing
+    density. Scanned pages get a neutral score, as nothing is known of them.
+    """
+    text = page.get_text("text")
+    if len(text.strip()) < 50:
+        return 2.0 if page.get_images() else 0.0  # A scan, or an (almost) empty page such as a cover
+    found_attributes = sum(1 for value in ATTRIBUTE_MATCHER.tag(text).values() if value is not None)
+    score = min(found_attributes, 5) * 2.0
+    if _count_rulings(page, 12) >= 12:
+        score += 3.0  # Ruled like a spec table
+    score += min(len(page.get_cdrawings()) / 200, 1.0) * 2.0  # Technical drawings carry dimensions and labels
+    return score
+
+
+def _score_pages(ctx: "_PdfContext") -> List[float]:
+    with ctx.render_lock:
+        scores = []
+        for page_num in range(ctx.total_pages):
+            try:
+                scores.append(score_page(ctx.pdf_document[page_num]))
             except Exception as e:
-                logger.error(f"Error processing page {page_num + 1} with Mistral Vision: {str(e)}", exc_info=True)#: Capture les erreurs lors du traitement d'une page spécifique
-                
+                logger.debug(f"Could not score page {page_num + 1} of {ctx.file_basename}: {e}")
+                scores.append(2.0)
+        return scores
+
+
+EXTRACTION_STRATEGIES = ("vision", "text", "auto")
+
+
+class _PdfContext:
+    """Per-file state shared by the page tasks of one PDF."""
+
+    def __init__(self, pdf_document, file_basename: str, file_hash: Optional[str], client: MistralClient,
+                 model_name: str, strategy: str, page_concurrency: int,
+                 on_document: Optional[Callable[[Document], None]] = None,
+                 deduplicator: Optional[PageDeduplicator] = None):
+        self.pdf_document = pdf_document
+        self.file_basename = file_basename
+        self.file_hash = file_hash
+        self.total_pages = len(pdf_document)
+        self.client = client
+        self.model_name = model_name
+        self.strategy = strategy
+        self.on_document = on_document  # Called on the event loop as soon as a page Document is ready
+        self.shared_pdf: Optional[_SharedPdf] = None  # Set when pages are rasterised in the process pool
+        self.deduplicator = deduplicator  # Shared by the files of a batch
+        self.duplicate_of: Dict[int, str] = {}  # Page index -> "file#page" whose OCR result it reuses
+        self.checkpoint: Optional[PageCheckpoint] = None  # Completed pages of an earlier, interrupted run
+        self.over_budget: set = set()  # Lowest-scored pages left out of vision OCR by PDF_VISION_PAGE_BUDGET
+        # With a vision page budget: page index -> priority rank, and per rank whether that page went to vision
+        self.vision_rank: Dict[int, int] = {}
+        self.vision_decisions: List["asyncio.Future[bool]"] = []
+        self.page_metrics: Dict[int, Dict[str, Any]] = {}  # Page index -> measurement record
+        self.packer: Optional[_VisionPagePacker] = None  # Set when small pages are packed into shared requests
+        # Page index -> (markdown, extraction method) of pages chunked once the file's boilerplate is known
+        self.deferred_pages: Optional[Dict[int, Tuple[str, str]]] = None
+        # PyMuPDF documents are not thread-safe: page access is serialised, the API calls overlap
+        self.render_lock = threading.Lock()
+        self.semaphore = asyncio.Semaphore(page_concurrency)
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "text_pages": 0, "vision_pages": 0,
+                      "render_ms": 0, "encode_ms": 0, "payload_bytes": 0, "api_ms": 0, "api_calls": 0,
+                      "prompt_tokens": 0, "output_tokens": 0, "duplicate_pages": 0,
+                      "resumed_pages": 0, "failed_pages": 0, "local_tables": 0, "table_fallbacks": 0,
+                      "skipped_pages": 0, "packed_pages": 0, "page_chars": 0, "boilerplate_chars": 0}
+
+
+def _extract_text_layer(ctx: _PdfContext, page_num: int) -> Tuple[str, bool, int]:
+    """Return the embedded text of a page, whether it is usable without OCR and the number of
+    tables rendered as markdown (runs in a worker thread).
+
+    A page whose table detection fails is not usable: its tables need the vision model.
+    """
+    with ctx.render_lock:
+        page = ctx.pdf_document[page_num]
+        blocks = page.get_text("blocks", sort=True)
+        page_rect = page.rect
+        image_area = 0.0
+        for info in page.get_image_info():
+            image_area += abs(fitz.Rect(info["bbox"]) & page_rect)
+
+        # Text blocks only (block_type 0), separated like markdown paragraphs
+        text = "\n\n".join(block[4].strip() for block in blocks if block[6] == 0 and block[4].strip())
+        page_area = abs(page_rect) or 1.0
+        image_ratio = min(image_area / page_area, 1.0)
+        chars_per_sq_inch = len(text) / (page_area / (72 * 72))
+        unreadable_ratio = text.count("\ufffd") / len(text) if text else 1.0  # Broken font encodings
+
+        usable = (
+            len(text) >= config.PDF_TEXT_MIN_CHARS
+            and chars_per_sq_inch >= config.PDF_TEXT_MIN_DENSITY
+            and image_ratio <= config.PDF_TEXT_MAX_IMAGE_RATIO
+            and unreadable_ratio < 0.05
+        )
+        table_count = 0
+        if config.PDF_TABLES_ENABLED and (usable or ctx.strategy == "text"):
+            markdown, table_count, table_failed = extract_page_markdown(page)
+            if markdown:
+                text = markdown
+            if table_failed:
+                usable = False
+                ctx.stats["table_fallbacks"] += 1
+    logger.debug(f"Text layer of page {page_num + 1}: {len(text)} chars, {chars_per_sq_inch:.1f} chars/in², "
+                 f"image coverage {image_ratio:.0%}, {table_count} tables -> {'usable' if usable else 'not usable'}")
+    return text, usable, table_count
+
+
+def _prepare_vision_image(ctx: _PdfContext, page_num: int) -> Tuple[str, Dict[str, int], int, int]:
+    """Render and encode one page (blocking, runs in a worker thread).
+
+    Returns the image data URL, the page's render/encode measurements, its pixel
+    count and, when pages are packed, the length of its text layer.
+    """
+    text_chars = 0
+    with ctx.render_lock:
+        page = ctx.pdf_document[page_num]
+        page_rect = page.rect
+        if ctx.packer is not None:
+            text_chars = len(page.get_text("text").strip())
+    logger.debug(f"Page dimensions: {page_rect}")
+    # Concurrent renders of all files stay within PDF_RENDER_MEMORY_BUDGET_MB
+    render_bytes = estimate_render_bytes(page_rect)
+    render_memory_budget.acquire(render_bytes)
+    try:
+        render_start = time.perf_counter()
+        if ctx.shared_pdf is not None:
+            img, dpi = render_page_in_process(get_render_process_pool(), ctx.shared_pdf, page_num)
+        else:
+            with ctx.render_lock:
+                img, dpi = render_page_image(ctx.pdf_document[page_num])
+        render_ms = (time.perf_counter() - render_start) * 1000
+        width, height, mode = img.width, img.height, img.mode
+
+        # Encode image to base64
+        encode_start = time.perf_counter()
+        base64_image, image_format = encode_pil_image(img, config.PDF_IMAGE_FORMAT, config.PDF_IMAGE_QUALITY)
+        encode_ms = (time.perf_counter() - encode_start) * 1000
+        del img  # Only the base64 payload outlives the budget
+    finally:
+        render_memory_budget.release(render_bytes)
+    page_info = {
+        "render_ms": int(render_ms),
+        "encode_ms": int(encode_ms),
+        "payload_bytes": len(base64_image),
+    }
+    logger.info(f"Page {page_num + 1} of {ctx.file_basename}: {width}x{height} px {mode} at {dpi:.0f} DPI, "
+                f"{image_format}, {len(base64_image) / 1024:.0f} KiB payload, "
+                f"render {render_ms:.0f} ms, encode {encode_ms:.0f} ms")
+    return f"data:image/{image_format};base64,{base64_image}", page_info, width * height, text_chars
+
+
+def _vision_messages(image_urls: List[str]) -> List[Dict[str, Any]]:
+    """Mistral Vision messages for one page image, or for several packed page images."""
+    prompt = MARKDOWN_PROMPT
+    if len(image_urls) > 1:
+        prompt += PACKED_PAGES_PROMPT.format(count=len(image_urls))
+    content = [{"type": "text", "text": prompt}]
+    content.extend({"type": "image_url", "image_url": image_url} for image_url in image_urls)
+    return [{"role": "user", "content": content}]
+
+
+def split_packed_markdown(markdown: str, page_count: int) -> Optional[List[str]]:
+    """Split the answer to a packed request into per-page markdown.
+
+    Returns None unless every page from 1 to ``page_count`` has exactly one delimiter.
+    """
+    parts = _PACKED_PAGE_DELIMITER.split(markdown)
+    pages: Dict[int, str] = {}
+    for i in range(1, len(parts) - 1, 2):
+        page_index = int(parts[i])
+        if page_index in pages:
+            return None
+        pages[page_index] = parts[i + 1].strip()
+    if sorted(pages) != list(range(1, page_count + 1)):
+        return None
+    return [pages[page_index] for page_index in range(1, page_count + 1)]
+
+
+def _call_vision_api(ctx: _PdfContext, messages: List[Dict[str, Any]]) -> Tuple[Optional[str], Dict[str, int]]:
+    """Send one prepared request to Mistral Vision (blocking, runs in a worker thread).
+
+    Returns the extracted text and the token usage reported by the API.
+    """
+    chat_response = ctx.client.chat(
+        model=ctx.model_name,
+        messages=messages#: Structure préparée avec prompt + image
+    )
+    logger.debug("Successfully received response from Mistral Vision API")
+    usage = getattr(chat_response, "usage", None)
+    tokens = {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+    # Get extracted text
+    return chat_response.choices[0].message.content, tokens
+
+
+async def _send_vision_request(ctx: _PdfContext, messages: List[Dict[str, Any]],
+                               label: str) -> Tuple[Optional[str], Dict[str, int]]:
+    """Send a vision request through the shared rate limiter.
+
+    Throttled (429), 5xx and connection failures are retried up to VISION_MAX_RETRIES
+    times, after the Retry-After delay when the API gives one. Returns the extracted
+    markdown and the call's measurements (API time and calls, tokens).
+    """
+    call_info = {"api_ms": 0, "api_calls": 0}
+    limiter = get_vision_rate_limiter()
+    for attempt in range(config.VISION_MAX_RETRIES + 1):
+        await limiter.acquire()
+        # Call Mistral Vision API
+        logger.info(f"Sending {label} to Mistral Vision API...")
+        api_start = time.perf_counter()
+        api_error: Optional[Exception] = None
+        succeeded, throttled, retry_after = False, False, None
+        try:
+            content, tokens = await _run_blocking(_call_vision_api, ctx, messages)
+            succeeded = True
+        except Exception as e:
+            api_error = e
+            throttled = getattr(e, "http_status", None) == 429
+            retry_after = _retry_after_seconds(e) if throttled else None
+        finally:
+            # Also when the task is cancelled mid-call: a leaked slot would shrink the shared window for good
+            limiter.release(throttled=throttled, retry_after=retry_after, succeeded=succeeded)
+        call_info["api_ms"] += int((time.perf_counter() - api_start) * 1000)
+        call_info["api_calls"] += 1
+        if succeeded:
+            call_info.update(tokens)
+            return content, call_info
+        if not _is_retryable_vision_error(api_error) or attempt == config.VISION_MAX_RETRIES:
+            limiter.record_failure()
+            logger.error(f"Mistral Vision API error: {str(api_error)}")
+            raise api_error
+        limiter.record_retry()
+        delay = retry_after if retry_after is not None else config.VISION_RETRY_BASE_DELAY * 2 ** attempt
+        delay *= random.uniform(1.0, 1.25)  # Jitter: copies of a throttled batch do not retry in lockstep
+        logger.warning(f"Mistral Vision API error on {label} "
+                       f"({str(api_error)[:200]}), retry {attempt + 1}/{config.VISION_MAX_RETRIES} in {delay:.1f} s")
+        await asyncio.sleep(delay)
+
+
+class _VisionPagePacker:
+    """
+    Packs the small pages of one file into multi-image vision requests.
+
+    A page is small when its encoded image is at most PDF_PACK_MAX_PAGE_KB and
+    its text layer at most PDF_PACK_MAX_PAGE_CHARS (title pages, short tables).
+    Small pages are collected until PDF_PACK_PAGES pages, the pixel budget or the
+    estimated output-token budget is reached, or for PDF_PACK_LINGER_MS, then sent
+    together with a prompt asking for page-delimited markdown. Pages wait for a
+    pack while holding their page-semaphore slot, which is why packing widens the
+    semaphore by PDF_PACK_PAGES. If the answer cannot be split back into pages,
+    the pages of the pack are sent again one by one.
+    """
+
+    def __init__(self, ctx: _PdfContext):
+        self.ctx = ctx
+        self._pending: List[Tuple[int, str, asyncio.Future]] = []
+        self._pending_pixels = 0
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @staticmethod
+    def estimate_output_tokens(text_chars: int) -> int:
+        # Scanned pages have no text layer: assume the largest small page
+        return (text_chars or config.PDF_PACK_MAX_PAGE_CHARS) // 4
+
+    def accepts(self, payload_bytes: int, pixels: int, text_chars: int) -> bool:
+        return (payload_bytes <= config.PDF_PACK_MAX_PAGE_KB * 1024
+                and text_chars <= config.PDF_PACK_MAX_PAGE_CHARS
+                and pixels <= config.PDF_PACK_PIXEL_BUDGET)
+
+    async def submit(self, page_num: int, image_url: str, pixels: int,
+                     text_chars: int) -> Tuple[Optional[str], Dict[str, int]]:
+        """Queue a small page for the next pack; returns its markdown and its share of the call."""
+        loop = asyncio.get_running_loop()
+        tokens = self.estimate_output_tokens(text_chars)
+        if self._pending and (self._pending_pixels + pixels > config.PDF_PACK_PIXEL_BUDGET
+                              or self._pending_tokens + tokens > config.PDF_PACK_TOKEN_BUDGET):
+            self._flush()
+        future = loop.create_future()
+        self._pending.append((page_num, image_url, future))
+        self._pending_pixels += pixels
+        self._pending_tokens += tokens
+        if len(self._pending) >= config.PDF_PACK_PAGES:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(config.PDF_PACK_LINGER_MS / 1000, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pack, self._pending = self._pending, []
+        self._pending_pixels = self._pending_tokens = 0
+        asyncio.ensure_future(self._send(pack))
+
+    async def _send(self, pack: List[Tuple[int, str, asyncio.Future]]) -> None:
+        ctx = self.ctx
+        page_nums = [page_num for page_num, _, _ in pack]
+        label = f"page{'s' if len(pack) > 1 else ''} {', '.join(str(p + 1) for p in page_nums)} of {ctx.file_basename}"
+        try:
+            content, call_info = await _send_vision_request(ctx, _vision_messages([url for _, url, _ in pack]), label)
+            pages = [content] if len(pack) == 1 else split_packed_markdown(content or "", len(pack))
+            if pages is not None:
+                results = [(page_content, self._share(call_info, i, len(pack))) for i, page_content in enumerate(pages)]
+            else:
+                logger.warning(f"Could not split the packed answer for {label}, sending the pages one by one")
+                results = []
+                for i, (page_num, image_url, _) in enumerate(pack):
+                    page_content, page_call = await _send_vision_request(
+                        ctx, _vision_messages([image_url]), f"page {page_num + 1} of {ctx.file_basename}")
+                    if i == 0:  # The failed pack is charged to the first page
+                        for key, value in call_info.items():
+                            page_call[key] = page_call.get(key, 0) + value
+                    results.append((page_content, page_call))
+        except Exception as e:
+            for _, _, future in pack:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(pack, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _share(call_info: Dict[str, int], index: int, count: int) -> Dict[str, int]:
+        """Split the measurements of a pack over its pages; the call itself is counted on the first page."""
+        share = {key: value // count for key, value in call_info.items()}
+        share["api_calls"] = call_info["api_calls"] if index == 0 else 0
+        if count > 1:
+            share["packed_pages"] = 1
+        return share
+
+
+async def _ocr_page(ctx: _PdfContext, page_num: int) -> Tuple[Optional[str], Dict[str, int]]:
+    """Render one page and send it to Mistral Vision, alone or packed with other small pages.
+
+    Returns the extracted markdown and the page's measurements (render/encode/API time, payload, tokens).
+    """
+    image_url, page_info, pixels, text_chars = await _run_blocking(_prepare_vision_image, ctx, page_num)
+    if ctx.packer is not None and ctx.packer.accepts(page_info["payload_bytes"], pixels, text_chars):
+        page_content, call_info = await ctx.packer.submit(page_num, image_url, pixels, text_chars)
+    else:
+        page_content, call_info = await _send_vision_request(ctx, _vision_messages([image_url]),
+                                                             f"page {page_num + 1} of {ctx.file_basename}")
+    page_info.update(call_info)
+    return page_content, page_info
+
+
+def _page_fingerprint(ctx: _PdfContext, page_num: int) -> Tuple[str, Optional[str]]:
+    with ctx.render_lock:
+        return page_fingerprint(ctx.pdf_document[page_num])
+
+
+def _decide_vision(ctx: _PdfContext, page_num: int, sent: bool) -> None:
+    """Record whether a page counts against the vision page budget (no-op without a budget)."""
+    rank = ctx.vision_rank.get(page_num)
+    if rank is not None and not ctx.vision_decisions[rank].done():
+        ctx.vision_decisions[rank].set_result(sent)
+
+
+async def _claim_vision_budget(ctx: _PdfContext, page_num: int) -> bool:
+    """Whether a page may be sent to vision under PDF_VISION_PAGE_BUDGET.
+
+    The budget counts pages actually sent to vision, in priority order: a page waits until
+    every better-scored page is decided (text layer, OCR cache, checkpoint or vision) and
+    gets a slot if fewer than the budget of them went to vision.
+    """
+    rank = ctx.vision_rank.get(page_num)
+    if rank is None:
+        return True
+    sent = 0
+    for decision in ctx.vision_decisions[:rank]:
+        sent += await asyncio.shield(decision)  # shield(): a cancelled page must not cancel another's decision
+    allowed = sent < config.PDF_VISION_PAGE_BUDGET
+    if not allowed:
+        ctx.over_budget.add(page_num)
+    _decide_vision(ctx, page_num, allowed)
+    return allowed
+
+
+async def _vision_page_content(ctx: _PdfContext, page_num: int) -> Optional[str]:
+    """Return the vision OCR markdown of a page, from the OCR cache when possible."""
+    cache = get_ocr_cache() if ctx.file_hash else None
+    cache_key = OCRPageCache.make_key(ctx.file_hash, page_num, ctx.model_name) if cache else None
+    page_content = await _run_blocking(cache.get, cache_key) if cache else None
+
+    metrics = ctx.page_metrics.setdefault(page_num, {})
+    if page_content is not None:
+        ctx.stats["cache_hits"] += 1
+        metrics["cache"] = "hit"
+        logger.info(f"OCR cache hit for page {page_num + 1}/{ctx.total_pages} of {ctx.file_basename}")
+        return page_content
+
+    if cache:
+        ctx.stats["cache_misses"] += 1
+        metrics["cache"] = "miss"
+    if not await _claim_vision_budget(ctx, page_num):
+        return None
+
+    group, is_first = None, False
+    if ctx.deduplicator is not None:
+        fingerprint = await _run_blocking(_page_fingerprint, ctx, page_num)
+        group, first_ref, is_first = ctx.deduplicator.claim(fingerprint, f"{ctx.file_basename}#{page_num + 1}")
+        if not is_first:
+            # shield(): a cancelled copy must not cancel the result the other copies wait for
+            page_content = await asyncio.shield(group)
+            if page_content:
+                ctx.stats["duplicate_pages"] += 1
+                ctx.duplicate_of[page_num] = first_ref
+                metrics["duplicate_of"] = first_ref
+                logger.info(f"Page {page_num + 1} of {ctx.file_basename} duplicates {first_ref}, reusing its OCR result")
+                return page_content  # Not cached under this page's key: only OCR results of the page itself are
+            # The first copy failed: OCR this one on its own
+
+    page_content = None
+    try:
+        async with ctx.semaphore:
+            logger.info(f"Processing page {page_num + 1}/{ctx.total_pages} of {ctx.file_basename}")# Numéro de page (commence à 1, pas 0),Nombre total de pages
+            page_content, page_info = await _ocr_page(ctx, page_num)
+    finally:
+        if is_first:
+            PageDeduplicator.resolve(group, page_content)
+    for key, value in page_info.items():
+        ctx.stats[key] += value
+    metrics.update(page_info)
+    if page_content and cache:
+        await _run_blocking(cache.put, cache_key, page_content)
+    return page_content
+
+
+async def _process_page(ctx: _PdfContext, page_num: int) -> List[Document]:
+    """Extract one page (text layer or vision, depending on the strategy) into its chunk Documents;
+    errors are contained to the page. Emits the page's measurement record."""
+    metrics = ctx.page_metrics.setdefault(page_num, {})
+    metrics.update(type="page", source=ctx.file_basename, page=page_num + 1, strategy=ctx.strategy)
+    start = time.perf_counter()
+    try:
+        return await _extract_page(ctx, page_num, metrics)
+    finally:
+        _decide_vision(ctx, page_num, False)  # Pages that never reached vision (text layer, cache, failures)
+        metrics["total_ms"] = int((time.perf_counter() - start) * 1000)
+        sink = get_pipeline_metrics()
+        if sink is not None and not (ctx.deferred_pages and page_num in ctx.deferred_pages):
+            sink.emit(metrics)
+
+
+async def _extract_page(ctx: _PdfContext, page_num: int, metrics: Dict[str, Any]) -> List[Document]:
+    page_content = None
+    extraction_method = "vision"
+    if ctx.checkpoint is not None and page_num in ctx.checkpoint.pages:
+        page_content, extraction_method = ctx.checkpoint.pages[page_num]
+        ctx.stats["resumed_pages"] += 1
+        metrics["resumed"] = True
+    else:
+        try:
+            if ctx.strategy != "vision":
+                text, usable, table_count = await _run_blocking(_extract_text_layer, ctx, page_num)
+                if usable or ctx.strategy == "text":
+                    page_content = text
+                    extraction_method = "text_layer"
+                    ctx.stats["local_tables"] += table_count
+            if extraction_method == "vision":
+                page_content = await _vision_page_content(ctx, page_num)
+        except Exception as e:
+            logger.error(f"Error processing page {page_num + 1} with Mistral Vision: {str(e)}", exc_info=True)#: Capture les erreurs lors du traitement d'une page spécifique
+            ctx.stats["failed_pages"] += 1
+            metrics.update(outcome="failed", error=str(e)[:200])
+            return []
+        if page_content is None and page_num in ctx.over_budget:
+            ctx.stats["skipped_pages"] += 1
+            metrics["outcome"] = "skipped"
+            logger.info(f"Skipped low-priority page {page_num + 1} of {ctx.file_basename} (vision page budget)")
+            return []
+        ctx.stats["text_pages" if extraction_method == "text_layer" else "vision_pages"] += 1
+        if ctx.checkpoint is not None:
+            await _run_blocking(ctx.checkpoint.record, page_num, page_content or "", extraction_method)
+
+    metrics.update(extraction_method=extraction_method, output_chars=len(page_content or ""))
+    if not page_content:
+        metrics["outcome"] = "empty"
+        logger.warning(f"No content extracted from page {page_num + 1} of {ctx.file_basename}")
+        return []
+    if ctx.deferred_pages is not None:
+        # Chunked by _finish_deferred_pages once the boilerplate of the whole file is known
+        ctx.deferred_pages[page_num] = (page_content, extraction_method)
+        return []
+    ctx.stats["page_chars"] += len(page_content)
+    return _page_documents(ctx, page_num, page_content, extraction_method, metrics)
+
+
+def _page_documents(ctx: _PdfContext, page_num: int, page_content: str, extraction_method: str,
+                    metrics: Dict[str, Any], document_metadata: Optional[Dict[str, Any]] = None,
+                    stripped_text: str = "") -> List[Document]:
+    """Chunk and tag one page into Documents and hand them to ``ctx.on_document``.
+
+    ``document_metadata`` is added to the first chunk only. ``stripped_text`` holds the lines
+    removed from the page as boilerplate; every chunk is tagged as if they were still in it.
+    """
+    # Log the extracted content
+    logger.debug(f"Extracted content of page {page_num + 1}:")
+    logger.debug("-" * 40)
+    logger.debug(page_content)
+    logger.debug("-" * 40)
+
+    # Split the page on headings and tables; each chunk keeps its page and is tagged on its own text
+    chunks = split_page_markdown(page_content) if config.CHUNKING_ENABLED else [page_content]
+    chunk_docs = []
+    tag_start = time.perf_counter()
+    for chunk_index, chunk_text in enumerate(chunks):
+        chunk_tags = tag_chunk_with_dictionary(f"{chunk_text}\n{stripped_text}" if stripped_text else chunk_text)#Marquage avec les attributs
+        chunk_doc = Document(#pour l'intégration avec les systèmes de recherche vectorielle)
+            page_content=chunk_text,
+            metadata={
+                'source': ctx.file_basename,
+                'page': page_num + 1,
+                'parent_page': f"{ctx.file_basename}#{page_num + 1}",
+                'chunk': chunk_index,
+                'chunk_count': len(chunks),
+                'extraction_method': extraction_method,
+                **chunk_tags  # Add all attribute tags to metadata
+            }
+        )
+        if page_num in ctx.duplicate_of:
+            chunk_doc.metadata['duplicate_of'] = ctx.duplicate_of[page_num]
+        if document_metadata and chunk_index == 0:
+            chunk_doc.metadata.update(document_metadata)
+        chunk_docs.append(chunk_doc)
+    metrics.update(outcome="ok", chunks=len(chunk_docs), tag_ms=round((time.perf_counter() - tag_start) * 1000, 1))
+    logger.success(f"Successfully processed page {page_num + 1} from {ctx.file_basename} "
+                   f"({extraction_method}, {len(chunk_docs)} chunks)")#confirmation
+    if ctx.on_document is not None:
+        for chunk_doc in chunk_docs:
+            ctx.on_document(chunk_doc)
+    return chunk_docs
+
+
+def _finish_deferred_pages(ctx: _PdfContext) -> Dict[int, List[Document]]:
+    """Strip the lines repeated across the pages of the file, then chunk the pages.
+
+    The removed lines are kept once, as ``document_boilerplate`` metadata of the
+    first chunk of the document.
+    """
+    pages = ctx.deferred_pages or {}
+    boilerplate = find_boilerplate_lines([content for content, _ in pages.values()])
+    removed: set = set()
+    stripped_pages: Dict[int, str] = {}
+    stripped_texts: Dict[int, str] = {}
+    for page_num, (content, _) in pages.items():
+        page_removed: set = set()
+        stripped_pages[page_num] = strip_boilerplate(content, boilerplate, page_removed) if boilerplate else content
+        stripped_texts[page_num] = "\n".join(line for line in content.split("\n") if _boilerplate_key(line) in page_removed)
+        removed |= page_removed
+    removed_lines = [line for key, line in boilerplate.items() if key in removed]
+    document_metadata = {"document_boilerplate": "\n".join(removed_lines)} if removed_lines else None
+    sink = get_pipeline_metrics()
+    docs_by_page: Dict[int, List[Document]] = {}
+    for page_num in sorted(pages):
+        page_content, extraction_method = pages[page_num]
+        metrics = ctx.page_metrics[page_num]
+        stripped = stripped_pages[page_num]
+        metrics["boilerplate_chars"] = len(page_content) - len(stripped)
+        ctx.stats["page_chars"] += len(page_content)
+        ctx.stats["boilerplate_chars"] += metrics["boilerplate_chars"]
+        if stripped:
+            docs_by_page[page_num] = _page_documents(ctx, page_num, stripped, extraction_method, metrics,
+                                                     document_metadata, stripped_texts[page_num])
+            document_metadata = None
+        else:
+            metrics["outcome"] = "boilerplate"
+            logger.info(f"Page {page_num + 1} of {ctx.file_basename} only contains boilerplate")
+        if sink is not None:
+            sink.emit(metrics)
+    if removed_lines:
+        logger.info(f"Removed {len(removed_lines)} boilerplate lines from {ctx.file_basename}: "
+                    f"{ctx.stats['boilerplate_chars']} of {ctx.stats['page_chars']} chars "
+                    f"({ctx.stats['boilerplate_chars'] / max(ctx.stats['page_chars'], 1):.1%})")
+    return docs_by_page
+
+
+def _open_pdf(pdf_source: Union[str, bytes]):
+    """Open a PDF with PyMuPDF (from memory when we already hold the bytes) and hash it for the OCR cache
+    and the page checkpoints."""
+    needs_hash = config.OCR_CACHE_ENABLED or config.PDF_CHECKPOINT_ENABLED
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+        file_hash = hashlib.sha256(pdf_source).hexdigest() if needs_hash else None
+    else:
+        logger.debug(f"File path: {pdf_source}")
+        pdf_document = fitz.open(pdf_source)
+        file_hash = hash_pdf_file(pdf_source) if needs_hash else None
+    return pdf_document, file_hash
+
+
+def _resolve_strategy(strategy: Optional[str]) -> str:
+    """Return a valid extraction strategy, falling back to config.PDF_EXTRACTION_STRATEGY."""
+    strategy = (strategy or config.PDF_EXTRACTION_STRATEGY).lower()
+    if strategy not in EXTRACTION_STRATEGIES:
+        logger.warning(f"Unknown extraction strategy '{strategy}', using 'vision'. Expected one of {EXTRACTION_STRATEGIES}")
+        strategy = "vision"
+    return strategy
+
+
+async def process_single_pdf(pdf_source: Union[str, bytes], file_basename: str, client: MistralClient, model_name: str,
+                             page_concurrency: Optional[int] = None,
+                             stats: Optional[Dict[str, int]] = None,
+                             strategy: Optional[str] = None,
+                             on_document: Optional[Callable[[Document], None]] = None,
+                             deduplicator: Optional[PageDeduplicator] = None,
+                             page_records: Optional[List[Dict[str, Any]]] = None) -> List[Document]:
+    """Process a single PDF (a file path or the PDF bytes) and return its documents in page order.
+
+    ``strategy`` selects how pages are read (defaults to ``config.PDF_EXTRACTION_STRATEGY``):
+    ``"vision"`` sends every page to the vision model, ``"text"`` only uses the embedded text
+    layer and ``"auto"`` uses the text layer when it is usable and vision otherwise. Vision pages
+    run at most ``page_concurrency`` at a time (defaults to ``config.PDF_PAGE_CONCURRENCY``), best
+    attribute-likelihood score first, and a failing page does not affect the others.
+
+    Before calling the API a page is looked up in the OCR cache, in the page checkpoint of an
+    interrupted run and, when ``deduplicator`` is given, among the identical pages of the batch.
+    Depending on the configuration, small pages are packed into shared vision requests
+    (``PDF_PACK_PAGES``), pages beyond ``PDF_VISION_PAGE_BUDGET`` are skipped and lines repeated
+    across pages are stripped before chunking (``PDF_BOILERPLATE_ENABLED``, which holds the
+    file's pages until all of them are extracted).
+
+    ``on_document`` is called with each page Document as soon as it is ready, for streaming
+    consumers. The per-file counters are added to ``stats`` and the per-page measurement records
+    (see ``PipelineMetrics``) appended to ``page_records`` when given.
+    """
+    all_docs = []
+    total_pages_processed = 0
+    pdf_document = None
+    file_stats: Dict[str, int] = {}
+    ctx: Optional[_PdfContext] = None
+    if page_concurrency is None:
+        page_concurrency = config.PDF_PAGE_CONCURRENCY
+    page_concurrency = max(1, page_concurrency)
+    strategy = _resolve_strategy(strategy)
+
+    try:
+        logger.info(f"Starting processing of PDF: {file_basename}")
+        logger.debug(f"Using model: {model_name}")
+
+        pdf_document, file_hash = await _run_blocking(_open_pdf, pdf_source)
+        ctx = _PdfContext(pdf_document, file_basename, file_hash, client, model_name, strategy, page_concurrency,
+                          on_document=on_document, deduplicator=deduplicator)
+        if strategy != "text" and get_render_process_pool() is not None:
+            pdf_bytes = pdf_source if isinstance(pdf_source, (bytes, bytearray, memoryview)) else pdf_document.tobytes()
+            ctx.shared_pdf = _SharedPdf(pdf_bytes)
+        file_stats = ctx.stats
+        logger.info(f"Successfully opened PDF with {ctx.total_pages} pages "
+                    f"(strategy: {strategy}, page concurrency: {page_concurrency})")
+        if config.PDF_CHECKPOINT_ENABLED and file_hash:
+            try:
+                ctx.checkpoint = await _run_blocking(PageCheckpoint, config.PDF_CHECKPOINT_DIR, file_hash,
+                                                     model_name, strategy)
+            except OSError as e:
+                logger.warning(f"Page checkpoints disabled for {file_basename}: {e}")
+            if ctx.checkpoint is not None and ctx.checkpoint.pages:
+                logger.info(f"Resuming {file_basename}: {len(ctx.checkpoint.pages)}/{ctx.total_pages} pages "
+                            f"already completed")
+
+        page_order = list(range(ctx.total_pages))
+        if strategy != "text" and config.PDF_PAGE_PRIORITY_ENABLED and ctx.total_pages > 1:
+            # Likely spec pages first: tasks queue on the page semaphore in creation order
+            scores = await _run_blocking(_score_pages, ctx)
+            page_order.sort(key=lambda page_num: -scores[page_num])
+            if 0 < config.PDF_VISION_PAGE_BUDGET < ctx.total_pages:
+                loop = asyncio.get_running_loop()
+                ctx.vision_rank = {page_num: rank for rank, page_num in enumerate(page_order)}
+                ctx.vision_decisions = [loop.create_future() for _ in page_order]
+            logger.info(f"Page priority of {file_basename}: {[page_num + 1 for page_num in page_order[:10]]}"
+                        f"{' ...' if ctx.total_pages > 10 else ''}")
+        if strategy != "text" and config.PDF_PACK_PAGES > 1:
+            ctx.packer = _VisionPagePacker(ctx)
+            # A pack is one request: keep about page_concurrency requests in flight
+            ctx.semaphore = asyncio.Semaphore(page_concurrency * config.PDF_PACK_PAGES)
+        if config.PDF_BOILERPLATE_ENABLED and ctx.total_pages >= config.PDF_BOILERPLATE_MIN_PAGES:
+            ctx.deferred_pages = {}
+        tasks = {page_num: asyncio.ensure_future(_process_page(ctx, page_num)) for page_num in page_order}
+        # gather() keeps the results in page order, whatever the completion order
+        results = await asyncio.gather(*[tasks[page_num] for page_num in range(ctx.total_pages)])
+        if ctx.deferred_pages is not None:
+            for page_num, page_docs in _finish_deferred_pages(ctx).items():
+                results[page_num] = page_docs
+        all_docs = [doc for page_docs in results for doc in page_docs]
+        total_pages_processed = sum(1 for page_docs in results if page_docs)
+
     except Exception as e:
         logger.error(f"Error processing {file_basename}: {str(e)}", exc_info=True)#Erreurs au niveau du fichier entier,Problèmes d'ouverture du PDF
     finally:
+        if ctx is not None and ctx.shared_pdf is not None:
+            ctx.shared_pdf.close()
+        if ctx is not None and ctx.checkpoint is not None:
+            # Keep the manifest while a page failed or was never reached, so the next attempt resumes;
+            # pages left out by the vision page budget are settled, like the recorded (possibly empty) ones
+            settled_pages = len(ctx.checkpoint.pages) + ctx.stats["skipped_pages"]
+            ctx.checkpoint.close(completed=not ctx.stats["failed_pages"] and settled_pages >= ctx.total_pages)
         # Close the PDF document if it was opened
         if pdf_document is not None:
             try:
@@ -222,33 +1934,109 @@ Output only the generated Markdown content.
                 logger.debug(f"Closed PDF document: {file_basename}")
             except Exception as e:
                 logger.warning(f"Error closing PDF document {file_basename}: {str(e)}")
-    
+
+    if file_stats.get("failed_pages"):
+        logger.error(f"{file_stats['failed_pages']} page(s) of {file_basename} failed and are missing from the results")
     if not all_docs:
         logger.error(f"No text could be extracted from {file_basename}")
     else:
         logger.info(f"\nProcessing Summary for {file_basename}:")
         logger.info(f"Total pages processed: {total_pages_processed}")
         logger.info(f"Total chunks created: {len(all_docs)}")
+        logger.info(f"Pages from text layer: {file_stats['text_pages']}, pages from vision OCR: {file_stats['vision_pages']}")
+        logger.info(f"Tables extracted locally: {file_stats['local_tables']}, "
+                    f"pages sent to vision after failed table detection: {file_stats['table_fallbacks']}")
+        logger.info(f"OCR cache hits: {file_stats['cache_hits']}, misses: {file_stats['cache_misses']}, "
+                    f"duplicate pages reused: {file_stats['duplicate_pages']}, "
+                    f"resumed from checkpoint: {file_stats['resumed_pages']}, "
+                    f"skipped by the vision page budget: {file_stats['skipped_pages']}")
+        logger.info(f"Vision payload: {file_stats['payload_bytes'] / 1e6:.2f} MB, render {file_stats['render_ms']} ms, "
+                    f"encode {file_stats['encode_ms']} ms")
         logger.debug(f"Average chunk size: {sum(len(doc.page_content) for doc in all_docs) / len(all_docs):.2f} characters")
-    
+
+    if ctx is not None and ctx.page_metrics:
+        records = [ctx.page_metrics[page_num] for page_num in sorted(ctx.page_metrics)]
+        file_summary = summarise_page_metrics(records)
+        logger.info(f"Page metrics for {file_basename}: {_format_metrics_summary(file_summary)}")
+        sink = get_pipeline_metrics()
+        if sink is not None:
+            sink.emit({"type": "file", "source": file_basename, **file_summary})
+        if page_records is not None:
+            page_records.extend(records)
+
+    if stats is not None:
+        for key, value in file_stats.items():
+            stats[key] = stats.get(key, 0) + value
     return all_docs#liste de tous les documents traités
 
-async def process_uploaded_pdfs(uploaded_files: List[BinaryIO], temp_dir: str = "temp_pdf") -> List[Document]:#fonction asynchrone qui traite plusieurs fichiers PDF uploadés en parallèle
-   #Répertoire temporaire pour sauvegarder les fichiers (défaut: "temp_pdf")
-    """Process uploaded PDFs using Mistral Vision for better text extraction."""
+PdfUpload = Union[BinaryIO, Tuple[str, bytes]]
+
+
+def _upload_name_and_bytes(uploaded_file: PdfUpload) -> Tuple[str, bytes]:
+    """Return (file name, PDF bytes) of an uploaded file or of a (name, bytes) pair."""
+    if isinstance(uploaded_file, tuple):
+        return uploaded_file
+    return uploaded_file.name, uploaded_file.getvalue()
+
+
+async def process_uploaded_pdfs(uploaded_files: List[PdfUpload],
+                                strategy: Optional[str] = None,
+                                page_records: Optional[List[Dict[str, Any]]] = None) -> List[Document]:#fonction asynchrone qui traite plusieurs fichiers PDF uploadés en parallèle
+    """Process uploaded PDFs using Mistral Vision for better text extraction.
+
+    ``uploaded_files`` are Streamlit uploads (anything with ``name`` and ``getvalue()``)
+    or ``(name, bytes)`` pairs such as ``st.session_state.uploaded_file_data``. The PDFs
+    are opened straight from those bytes, nothing is written to disk. ``strategy``
+    ("vision", "text" or "auto") is applied to every file of the run, see ``process_single_pdf``.
+    The per-page measurement records (outcome, timings) are appended to ``page_records`` if given.
+    """
+    return await _process_pdf_batch(uploaded_files, strategy, page_records=page_records)
+
+
+async def stream_uploaded_pdfs(uploaded_files: List[PdfUpload],
+                               strategy: Optional[str] = None) -> AsyncIterator[Document]:
+    """Like process_uploaded_pdfs, but yield each page Document as soon as it is ready (completion order).
+
+    With PDF_BOILERPLATE_ENABLED the pages of a file are yielded together once the whole file is
+    extracted, as its repeated lines are only known then.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            await _process_pdf_batch(uploaded_files, strategy, on_document=queue.put_nowait)
+        finally:
+            queue.put_nowait(done)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            doc = await queue.get()
+            if doc is done:
+                break
+            yield doc
+        await producer  # Surface unexpected errors of the batch
+    finally:
+        if not producer.done():
+            producer.cancel()
+
+
+async def _process_pdf_batch(uploaded_files: List[PdfUpload], strategy: Optional[str],
+                             on_document: Optional[Callable[[Document], None]] = None,
+                             page_records: Optional[List[Dict[str, Any]]] = None) -> List[Document]:
+    """Process a batch of PDFs concurrently and log the batch summary."""
     all_docs: List[Document] = []# Liste vide qui va contenir tous les documents extraits
-    saved_file_paths: List[str] = []#Liste vide qui va contenir les chemins des fichiers temporaires
+    pdf_files: List[Tuple[str, bytes]] = []#Liste (nom, contenu) des PDFs à traiter
+    file_stats: List[Dict[str, int]] = []# Compteurs (cache OCR, méthode d'extraction) de chaque fichier
     
     logger.info(f"Starting batch processing of {len(uploaded_files)} PDF files")#Affiche le nombre de fichiers à traiter
-    logger.debug(f"Temporary directory: {temp_dir}")#Affiche le répertoire temporaire utilisé
-    
-    # Create temp directory if it doesn't exist
-    os.makedirs(temp_dir, exist_ok=True)#Crée le répertoire s'il n'existe pas
-    logger.debug("Ensured temporary directory exists")
     
     # Initialize Mistral client
     try:
-        client = MistralClient(api_key=os.getenv("MISTRAL_API_KEY"))
+        # Retries and Retry-After waits are done by _send_vision_request under the shared rate limiter,
+        # not by the client's own backoff
+        client = MistralClient(api_key=os.getenv("MISTRAL_API_KEY"), max_retries=1)
         model_name = config.VISION_MODEL_NAME
         logger.info(f"Initialized Mistral Vision client with model: {model_name}")
     except Exception as e:
@@ -256,72 +2044,99 @@ async def process_uploaded_pdfs(uploaded_files: List[BinaryIO], temp_dir: str =
         return []
     
     try:
-        # Save all files first
-        for uploaded_file in uploaded_files:#Chaque fichier uploadé est sauvegardé temporairement sur le disque
-            file_basename = uploaded_file.name
-            file_path = os.path.join(temp_dir, file_basename)
-            saved_file_paths.append(file_path)
-            logger.debug(f"Saving uploaded file: {file_basename}")
-            # Save uploaded file temporarily
-            with open(file_path, "wb") as f:#Sauvegarde en mode binaire ("wb")
-                f.write(uploaded_file.getvalue())
-            logger.debug(f"Successfully saved file: {file_basename}")
+        # The bytes are only referenced, never copied: fitz opens the PDF from the same buffer
+        pdf_files = [_upload_name_and_bytes(uploaded_file) for uploaded_file in uploaded_files]
         
-        # Process PDFs in parallel using ThreadPoolExecutor
-        logger.info(f"Starting parallel processing of {len(saved_file_paths)} files")
-        with ThreadPoolExecutor(max_workers=min(len(saved_file_paths), 4)) as executor:
-            # Create tasks for each PDF
-            loop = asyncio.get_event_loop()# Récupère la boucle d'événements asynchrone
-            tasks: List[asyncio.Task] = []#Liste vide pour stocker les tâches
-            for file_path in saved_file_paths:
-                file_basename = os.path.basename(file_path)#Extrait juste le nom du fichier du chemin complet
-                logger.debug(f"Creating task for file: {file_basename}")
-                # Create a task that runs in the thread pool
-                task = loop.run_in_executor(
-                    executor,
-                    lambda p, b: asyncio.run(process_single_pdf(p, b, client, model_name)), # Fonction synchrone qui lance une async
-                    file_path,
-                    file_basename
-                )
-                tasks.append(task)# Ajoute la tâche à la liste
-            
-            # Wait for all PDFs to be processed
-            logger.info("Waiting for all PDF processing tasks to complete...")
+        # Files are tasks on the current event loop; their blocking work shares pdf_thread_pool
+        logger.info(f"Starting parallel processing of {len(pdf_files)} files")
+        file_semaphore = asyncio.Semaphore(max(1, config.PDF_FILE_CONCURRENCY))
+        deduplicator = PageDeduplicator() if config.PDF_DEDUP_ENABLED else None
+        page_records = [] if page_records is None else page_records
+
+        async def process_file(file_basename: str, pdf_bytes: bytes, stats: Dict[str, int]) -> List[Document]:
+            async with file_semaphore:
+                return await process_single_pdf(pdf_bytes, file_basename, client, model_name, stats=stats,
+                                                strategy=strategy, on_document=on_document,
+                                                deduplicator=deduplicator, page_records=page_records)
+
+        tasks = []
+        for file_basename, pdf_bytes in pdf_files:
+            logger.debug(f"Creating task for file: {file_basename} ({len(pdf_bytes)} bytes)")
+            file_stats.append({})
+            tasks.append(process_file(file_basename, pdf_bytes, file_stats[-1]))
+
+        # Wait for all PDFs to be processed
+        logger.info("Waiting for all PDF processing tasks to complete...")
+        with PeakRSSMonitor() as rss_monitor:
             results = await asyncio.gather(*tasks)#Attend que toutes les tâches se terminent
-            logger.info("All PDF processing tasks completed")
-            
-            # Combine all results in a deterministic order (by file name)
-            results = [docs for docs in results if docs]
-            results.sort(key=lambda docs: docs[0].metadata['source'] if docs and hasattr(docs[0], 'metadata') and 'source' in docs[0].metadata else '')#Trie les résultats par nom de fichier source
-            all_docs = []
-            for docs in results:
-                all_docs.extend(docs)#Ajoute tous les documents de ce résultat
-                logger.debug(f"Added {len(docs)} documents from a processed file")#Affiche le nombre de documents ajoutés
-            
+        logger.info(f"Peak RSS during this ingest: {rss_monitor.peak_bytes / 1e6:.0f} MB "
+                    f"(render budget: peak {render_memory_budget.peak_in_use / 1e6:.0f} MB of "
+                    f"{f'{render_memory_budget.max_bytes / 1e6:.0f} MB' if render_memory_budget.max_bytes else 'unlimited'}, "
+                    f"{render_memory_budget.waits} renders waited)")
+        logger.info("All PDF processing tasks completed")
+
+        # Combine all results in a deterministic order (by file name)
+        results = [docs for docs in results if docs]
+        results.sort(key=lambda docs: docs[0].metadata['source'] if docs and hasattr(docs[0], 'metadata') and 'source' in docs[0].metadata else '')#Trie les résultats par nom de fichier source
+        all_docs = []
+        for docs in results:
+            all_docs.extend(docs)#Ajoute tous les documents de ce résultat
+            logger.debug(f"Added {len(docs)} documents from a processed file")#Affiche le nombre de documents ajoutés
+
     except Exception as e:
         logger.error(f"Error during batch PDF processing: {str(e)}", exc_info=True)
-    finally:
-        # Clean up temporary files
-        logger.info("Cleaning up temporary files...")
-        for path in saved_file_paths:
-            try:
-                os.remove(path)#Supprime le fichier temporaire
-                logger.debug(f"Removed temporary file: {path}")
-            except OSError as e:
-                logger.warning(f"Could not remove temporary file {path}: {str(e)}")
     
     if not all_docs:
         logger.error("No text could be extracted from any provided PDF files.")# Si aucun document n'a été extrait
     else:
         logger.info("\nFinal Processing Summary:")
-        logger.info(f"Total documents processed: {len(saved_file_paths)}")
+        logger.info(f"Total documents processed: {len(pdf_files)}")
         logger.info(f"Total chunks created: {len(all_docs)}")
-        logger.debug(f"Average chunks per document: {len(all_docs) / len(saved_file_paths):.2f}")
+        logger.debug(f"Average chunks per document: {len(all_docs) / len(pdf_files):.2f}")
+    text_pages = sum(st.get("text_pages", 0) for st in file_stats)
+    vision_pages = sum(st.get("vision_pages", 0) for st in file_stats)
+    logger.info(f"Pages from text layer: {text_pages}, pages from vision OCR: {vision_pages}")
+    if text_pages + vision_pages:
+        logger.info(f"Pages served locally: {text_pages / (text_pages + vision_pages):.0%} "
+                    f"({sum(st.get('local_tables', 0) for st in file_stats)} tables extracted locally, "
+                    f"{sum(st.get('table_fallbacks', 0) for st in file_stats)} pages sent to vision after failed table detection)")
+    payload_bytes = sum(st.get("payload_bytes", 0) for st in file_stats)
+    logger.info(f"Vision payload: {payload_bytes / 1e6:.2f} MB, render {sum(st.get('render_ms', 0) for st in file_stats)} ms, "
+                f"encode {sum(st.get('encode_ms', 0) for st in file_stats)} ms")
+    if page_records:
+        batch_summary = summarise_page_metrics(page_records)
+        logger.info(f"Page metrics for the batch: {_format_metrics_summary(batch_summary)}")
+        sink = get_pipeline_metrics()
+        if sink is not None:
+            sink.emit({"type": "batch", "files": len(pdf_files), **batch_summary})
+    failed_pages = sum(st.get("failed_pages", 0) for st in file_stats)
+    if failed_pages:
+        logger.error(f"Pages that could not be extracted: {failed_pages}")
+    logger.info(f"Vision rate limiter: {get_vision_rate_limiter().metrics()}")
+    duplicate_pages = sum(st.get("duplicate_pages", 0) for st in file_stats)
+    if duplicate_pages:
+        logger.info(f"Duplicate pages served from an identical page of the batch: {duplicate_pages}")
+    boilerplate_chars = sum(st.get("boilerplate_chars", 0) for st in file_stats)
+    if boilerplate_chars:
+        page_chars = sum(st.get("page_chars", 0) for st in file_stats)
+        logger.info(f"Boilerplate removed before embedding: {boilerplate_chars} of {page_chars} chars "
+                    f"({boilerplate_chars / page_chars:.1%})")
+    cache_hits = sum(st.get("cache_hits", 0) for st in file_stats)
+    cache_misses = sum(st.get("cache_misses", 0) for st in file_stats)
+    if cache_hits or cache_misses:
+        logger.info(f"OCR cache hits: {cache_hits}, misses: {cache_misses} "
+                    f"(hit rate: {cache_hits / (cache_hits + cache_misses):.0%})")
     
     return all_docs
 
-def process_pdfs_in_background(uploaded_files: List[BinaryIO], temp_dir: str = "temp_pdf") -> asyncio.Task[List[Document]]:
+def process_uploaded_pdfs_sync(uploaded_files: List[PdfUpload], strategy: Optional[str] = None) -> List[Document]:
+    """Synchronous entry point (Streamlit): run process_uploaded_pdfs on the shared PDF event loop."""
+    return run_pdf_coroutine(process_uploaded_pdfs(uploaded_files, strategy=strategy))
+
+
+def process_pdfs_in_background(uploaded_files: List[PdfUpload],
+                               strategy: Optional[str] = None) -> asyncio.Task[List[Document]]:
     """Start PDF processing in the background and return a task that can be awaited later."""
-    return asyncio.create_task(process_uploaded_pdfs(uploaded_files, temp_dir))
+    return asyncio.create_task(process_uploaded_pdfs(uploaded_files, strategy=strategy))
 
 
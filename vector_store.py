@@ -1,32 +1,90 @@
 # vector_store.py
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Callable, AsyncIterator
 from loguru import logger
+import os
+import re
+import json
 import time
+import hashlib
+import sqlite3
+from array import array
+import numpy as np
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from langchain_community.vectorstores import Chroma
 from langchain.docstore.document import Document
 from langchain.embeddings.base import Embeddings
 import config # Import configuration
 
 # --- Custom Hugging Face API Embeddings ---
+def _parse_embeddings_response(result) -> List[List[float]]:
+    """Extract the embeddings from the API response, whatever its format."""
+    if "embeddings" in result:
+        return result["embeddings"]
+    if "vectors" in result:
+        return result["vectors"]
+    if isinstance(result, list):
+        # If the API returns embeddings directly as a list
+        return result
+    # Try to find embeddings in the response structure
+    embeddings = result.get("data", result.get("result", result))
+    if not isinstance(embeddings, list):
+        raise ValueError(f"Unexpected API response format: {result}")
+    return embeddings
+
+
 class HuggingFaceAPIEmbeddings(Embeddings):
-    """Custom embeddings class that uses Hugging Face API instead of local model."""
+    """Custom embeddings class that uses Hugging Face API instead of local model.
+
+    Requests go through one pooled keep-alive session; up to ``max_concurrency``
+    batches (config.EMBEDDING_CONCURRENCY) are in flight at the same time. Batches
+    are packed by size (count and characters) and split in two when they fail.
+    """
     
-    def __init__(self, api_url: str = "https://sabrinekh-embedder-model.hf.space/embed"):
+    def __init__(self, api_url: str = "https://sabrinekh-embedder-model.hf.space/embed",
+                 max_concurrency: Optional[int] = None):
         self.api_url = api_url
-        logger.info(f"Initialized HuggingFace API embeddings with URL: {api_url}")
-    
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents using the Hugging Face API with batching and text length limiting."""
-        if not texts:
-            return []
-        
-        # Batch size - adjust based on your API's capacity
-        batch_size = config.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max(1, max_concurrency or config.EMBEDDING_CONCURRENCY)
+        self.batches_sent = 0  # Successful embedding API batches, for throughput reports
+        self.timeouts = 0  # Timed out embedding requests
+        self.split_batches = 0  # Failed batches split in two and retried as halves
+        self._counter_lock = threading.Lock()
+        # Keep-alive connections, one per concurrent batch: no TLS handshake per request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        logger.info(f"Initialized HuggingFace API embeddings with URL: {api_url} "
+                    f"({self.max_concurrency} concurrent batches)")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix="embedding-batch")
+            return self._executor
+
+    def _post_texts(self, texts: List[str]) -> List[List[float]]:
+        """One embedding request on the pooled session."""
+        response = self.session.post(
+            self.api_url,
+            json={"texts": texts},
+            timeout=config.EMBEDDING_TIMEOUT  # Configurable timeout for batch processing
+        )
+        # Check if the request was successful
+        response.raise_for_status()
+        return _parse_embeddings_response(response.json())
+
+    @staticmethod
+    def _truncate_texts(texts: List[str]) -> List[str]:
+        """Pre-process texts to limit length."""
         max_text_length = config.EMBEDDING_MAX_TEXT_LENGTH
-        all_embeddings = []
-        
-        # Pre-process texts to limit length
         processed_texts = []
         for text in texts:
             if len(text) > max_text_length:
@@ -35,82 +93,122 @@ class HuggingFaceAPIEmbeddings(Embeddings):
             else:
                 processed_text = text
             processed_texts.append(processed_text)
-        
-        # Process texts in batches
-        for i in range(0, len(processed_texts), batch_size):
-            batch_texts = processed_texts[i:i + batch_size]
-            batch_num = i//batch_size + 1
-            total_batches = (len(processed_texts) + batch_size - 1)//batch_size
-            
-            logger.debug(f"Processing batch {batch_num}/{total_batches} with {len(batch_texts)} texts")
-            
-            # Calculate total characters in this batch
-            total_chars = sum(len(text) for text in batch_texts)
-            logger.debug(f"Batch {batch_num} total characters: {total_chars}")
-            
-            # Retry logic for failed batches
-            max_retries = 3
-            for retry in range(max_retries):
-                try:
-                    # Prepare the request payload
-                    payload = {"texts": batch_texts}
-                    
-                    # Make the API request with increased timeout for batches
-                    response = requests.post(
-                        self.api_url,
-                        headers={"Content-Type": "application/json"},
-                        json=payload,
-                        timeout=config.EMBEDDING_TIMEOUT  # Configurable timeout for batch processing
-                    )
-                    
-                    # Check if the request was successful
-                    response.raise_for_status()
-                    
-                    # Parse the response
-                    result = response.json()
-                    
-                    # Extract embeddings from the response
-                    # Handle different API response formats
-                    if "embeddings" in result:
-                        batch_embeddings = result["embeddings"]
-                    elif "vectors" in result:
-                        batch_embeddings = result["vectors"]
-                    elif isinstance(result, list):
-                        # If the API returns embeddings directly as a list
-                        batch_embeddings = result
-                    else:
-                        # Try to find embeddings in the response structure
-                        batch_embeddings = result.get("data", result.get("result", result))
-                        if not isinstance(batch_embeddings, list):
-                            raise ValueError(f"Unexpected API response format: {result}")
-                    
-                    all_embeddings.extend(batch_embeddings)
-                    logger.debug(f"Successfully embedded batch {batch_num} with {len(batch_texts)} documents")
-                    
-                    # Success, break out of retry loop
-                    break
-                    
-                except requests.exceptions.Timeout:
-                    logger.warning(f"Batch {batch_num} timed out (attempt {retry + 1}/{max_retries})")
-                    if retry == max_retries - 1:
-                        logger.error(f"Batch {batch_num} failed after {max_retries} timeout attempts")
-                        raise
-                    time.sleep(1)  # Wait before retry
-                    
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"Batch {batch_num} failed (attempt {retry + 1}/{max_retries}): {e}")
-                    if retry == max_retries - 1:
-                        logger.error(f"Batch {batch_num} failed after {max_retries} attempts")
-                        raise
-                    time.sleep(1)  # Wait before retry
-                    
-                except Exception as e:
-                    logger.error(f"Unexpected error in batch {batch_num}: {e}")
+        return processed_texts
+
+    def _make_batches(self, texts: List[str]) -> List[List[str]]:
+        """Pack consecutive texts into batches of at most EMBEDDING_BATCH_SIZE texts
+        and EMBEDDING_BATCH_MAX_CHARS characters (a longer text is a batch of its own)."""
+        max_items = max(1, config.EMBEDDING_BATCH_SIZE)
+        max_chars = config.EMBEDDING_BATCH_MAX_CHARS
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_chars = 0
+        for text in texts:
+            if current and (len(current) >= max_items or (max_chars and current_chars + len(text) > max_chars)):
+                batches.append(current)
+                current, current_chars = [], 0
+            current.append(text)
+            current_chars += len(text)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _split_batch(self, batch_texts: List[str], batch_num: str, total_batches: int, reason: str) -> List[List[float]]:
+        """Embed the two halves of a failed batch separately (each splits again if it fails)."""
+        half = len(batch_texts) // 2
+        logger.warning(f"Batch {batch_num} {reason}, splitting its {len(batch_texts)} texts "
+                       f"({sum(len(text) for text in batch_texts)} chars) into {half} + {len(batch_texts) - half}")
+        with self._counter_lock:
+            self.split_batches += 1
+        return (self._embed_batch(batch_texts[:half], f"{batch_num}a", total_batches)
+                + self._embed_batch(batch_texts[half:], f"{batch_num}b", total_batches))
+
+    def _embed_batch(self, batch_texts: List[str], batch_num, total_batches: int) -> List[List[float]]:
+        """Embed one batch, retrying timeouts and request errors (runs in a worker thread).
+
+        A batch of several texts that times out or is rejected as too large (413) is split
+        in two at once; after its last retry on other request errors as well. Only a
+        single text that keeps failing raises.
+        """
+        logger.debug(f"Processing batch {batch_num}/{total_batches} with {len(batch_texts)} texts")
+        # Calculate total characters in this batch
+        total_chars = sum(len(text) for text in batch_texts)
+        logger.debug(f"Batch {batch_num} total characters: {total_chars}")
+
+        # Retry logic for failed batches
+        max_retries = 3
+        for retry in range(max_retries):
+            try:
+                batch_embeddings = self._post_texts(batch_texts)
+                with self._counter_lock:
+                    self.batches_sent += 1
+                logger.debug(f"Successfully embedded batch {batch_num} with {len(batch_texts)} documents")
+                return batch_embeddings
+
+            except requests.exceptions.Timeout:
+                with self._counter_lock:
+                    self.timeouts += 1
+                logger.warning(f"Batch {batch_num} timed out (attempt {retry + 1}/{max_retries})")
+                if len(batch_texts) > 1:
+                    return self._split_batch(batch_texts, batch_num, total_batches, "timed out")
+                if retry == max_retries - 1:
+                    logger.error(f"Batch {batch_num} failed after {max_retries} timeout attempts")
                     raise
-        
-        logger.info(f"Successfully embedded {len(processed_texts)} documents in {len(all_embeddings)} batches")
+                time.sleep(1)  # Wait before retry
+
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Batch {batch_num} failed (attempt {retry + 1}/{max_retries}): {e}")
+                response = getattr(e, "response", None)
+                too_large = response is not None and response.status_code == 413
+                if len(batch_texts) > 1 and (too_large or retry == max_retries - 1):
+                    return self._split_batch(batch_texts, batch_num, total_batches, f"failed ({e})")
+                if retry == max_retries - 1:
+                    logger.error(f"Batch {batch_num} failed after {max_retries} attempts")
+                    raise
+                time.sleep(1)  # Wait before retry
+
+            except Exception as e:
+                logger.error(f"Unexpected error in batch {batch_num}: {e}")
+                raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents using the Hugging Face API with batching and text length limiting.
+
+        Batches are sent concurrently; the embeddings are returned in input order.
+        A batch that still fails after its retries fails the whole call.
+        """
+        if not texts:
+            return []
+
+        processed_texts = self._truncate_texts(texts)
+        batches = self._make_batches(processed_texts)
+        if len(batches) == 1 or self.max_concurrency == 1:
+            results = [self._embed_batch(batch, i + 1, len(batches)) for i, batch in enumerate(batches)]
+        else:
+            # map() yields in submission order and re-raises the first failed batch
+            results = list(self._get_executor().map(
+                self._embed_batch, batches, range(1, len(batches) + 1), [len(batches)] * len(batches)))
+        all_embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+        logger.info(f"Successfully embedded {len(processed_texts)} documents in {len(batches)} batches")
         return all_embeddings
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async embed_documents: the batches run on the embedding threads, the event loop stays free."""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        batches = self._make_batches(self._truncate_texts(texts))
+        executor = self._get_executor()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, self._embed_batch, batch, i + 1, len(batches))
+            for i, batch in enumerate(batches)
+        ])
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.embed_query, text)
+
     def embed_documents_fallback(self, texts: List[str]) -> List[List[float]]:
         """Fallback embedding method for individual document processing."""
         if not texts:
@@ -129,29 +227,11 @@ class HuggingFaceAPIEmbeddings(Embeddings):
                     processed_text = text
                 
                 # Process single document
-                payload = {"texts": [processed_text]}
-                
-                response = requests.post(
-                    self.api_url,
-                    headers={"Content-Type": "application/json"},
-                    json=payload,
-                    timeout=config.EMBEDDING_TIMEOUT
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                # Extract single embedding
-                if "embeddings" in result:
-                    embedding = result["embeddings"][0]
-                elif "vectors" in result:
-                    embedding = result["vectors"][0]
-                elif isinstance(result, list):
-                    embedding = result[0]
-                else:
-                    embedding = result.get("data", result.get("result", result))[0]
+                embedding = self._post_texts([processed_text])[0]
                 
                 all_embeddings.append(embedding)
+                with self._counter_lock:
+                    self.batches_sent += 1
                 logger.debug(f"Successfully embedded document {i+1}/{len(texts)}")
                 
             except Exception as e:
@@ -176,58 +256,506 @@ class HuggingFaceAPIEmbeddings(Embeddings):
             processed_text = text
         
         try:
-            # Prepare the request payload
-            payload = {"texts": [processed_text]}
-            
-            # Make the API request
-            response = requests.post(
-                self.api_url,
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=config.EMBEDDING_TIMEOUT
-            )
-            
-            # Check if the request was successful
-            response.raise_for_status()
-            
-            # Parse the response
-            result = response.json()
-            
-            # Extract embedding from the response
-            if "embeddings" in result:
-                embedding = result["embeddings"][0]
-            elif "vectors" in result:
-                embedding = result["vectors"][0]
-            elif isinstance(result, list):
-                embedding = result[0]
-            else:
-                embedding = result.get("data", result.get("result", result))[0]
-            
-            return embedding
+            # Make the API request on the pooled session
+            return self._post_texts([processed_text])[0]
             
         except Exception as e:
             logger.error(f"Failed to embed query: {e}")
             # Return zero vector as fallback
             return [0.0] * 1024  # Assuming 768-dimensional embeddings
 
+# --- Local CPU Embeddings ---
+def _embedding_model_key() -> str:
+    """Identity of the vectors of the configured backend, for the caches keyed by model."""
+    if config.EMBEDDING_BACKEND == "local" and config.EMBEDDING_LOCAL_ONNX:
+        return f"{config.EMBEDDING_MODEL_NAME}@onnx-int8"  # Quantised vectors differ slightly from the full model
+    return config.EMBEDDING_MODEL_NAME
+
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings computed on CPU in this process instead of the embedding API.
+
+    Runs the model with sentence-transformers, or with ``use_onnx`` an int8 dynamically
+    quantised ONNX export of it with ONNX Runtime (exported once under ``onnx_dir``, the
+    export needs torch; afterwards only onnxruntime and tokenizers are used). Texts are
+    encoded in batches of ``batch_size`` sorted by length, one batch at a time on
+    ``threads`` intra-op threads. The model must produce config.EMBEDDING_DIMENSIONS
+    dimensions, so its vectors can be searched in the existing collections.
+    """
+
+    def __init__(self, model_name: str, batch_size: Optional[int] = None, threads: Optional[int] = None,
+                 use_onnx: Optional[bool] = None, onnx_dir: Optional[str] = None, max_tokens: Optional[int] = None):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size or config.EMBEDDING_LOCAL_BATCH_SIZE)
+        self.threads = config.EMBEDDING_LOCAL_THREADS if threads is None else threads
+        self.use_onnx = config.EMBEDDING_LOCAL_ONNX if use_onnx is None else use_onnx
+        self.onnx_dir = onnx_dir or config.EMBEDDING_LOCAL_ONNX_DIR
+        self.max_tokens = config.EMBEDDING_LOCAL_MAX_TOKENS if max_tokens is None else max_tokens
+        self.batches_sent = 0  # Encoded batches, for throughput reports
+        self._inference_lock = threading.Lock()  # One batch at a time, the intra-op threads do the parallel work
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        start = time.perf_counter()
+        if self.use_onnx:
+            self._load_onnx()
+        else:
+            self._load_sentence_transformer()
+        if self.dimensions != config.EMBEDDING_DIMENSIONS:
+            raise ValueError(f"Local model '{model_name}' produces {self.dimensions} dimensions, "
+                             f"the collections use EMBEDDING_DIMENSIONS={config.EMBEDDING_DIMENSIONS}")
+        logger.info(f"Initialized local embeddings with {model_name} ({'ONNX int8' if self.use_onnx else 'sentence-transformers'}, "
+                    f"{self.threads or 'default'} threads, batch size {self.batch_size}) "
+                    f"in {time.perf_counter() - start:.1f}s")
+
+    def _load_sentence_transformer(self):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=local needs sentence-transformers and torch") from e
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+        if self.max_tokens > 0:
+            self.model.max_seq_length = self.max_tokens
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+
+    def _onnx_export_dir(self) -> str:
+        return os.path.join(self.onnx_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", self.model_name))
+
+    def _export_onnx(self, export_dir: str) -> None:
+        """Export the transformer of the sentence-transformers model to ONNX and quantise its weights to int8."""
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            raise ImportError("Exporting the ONNX model needs sentence-transformers, torch and onnxruntime") from e
+        logger.info(f"Exporting {self.model_name} to ONNX (int8) in '{export_dir}', this is done once")
+        model = SentenceTransformer(self.model_name, device="cpu")
+        pooling = model[1]
+        if pooling.pooling_mode_cls_token:
+            pooling_mode = "cls"
+        elif pooling.pooling_mode_mean_tokens:
+            pooling_mode = "mean"
+        else:
+            raise ValueError(f"Unsupported pooling of '{self.model_name}' for the ONNX export")
+        fp32_dir = os.path.join(export_dir, "fp32")
+        os.makedirs(fp32_dir, exist_ok=True)
+        fp32_path = os.path.join(fp32_dir, "model.onnx")
+        transformer = model[0].auto_model.eval()
+        sample = model.tokenizer(["export"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer, (sample["input_ids"], sample["attention_mask"]), fp32_path,
+                input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                dynamic_axes={name: {0: "batch", 1: "sequence"}
+                              for name in ("input_ids", "attention_mask", "last_hidden_state")},
+                opset_version=14,
+            )
+        quantize_dynamic(fp32_path, os.path.join(export_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+        model.tokenizer.save_pretrained(export_dir)
+        with open(os.path.join(export_dir, "export.json"), "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "pooling": pooling_mode,
+                       "normalize": any(type(module).__name__ == "Normalize" for module in model),
+                       "dimensions": model.get_sentence_embedding_dimension(),
+                       "max_tokens": model.max_seq_length, "pad_token": model.tokenizer.pad_token,
+                       "pad_token_id": model.tokenizer.pad_token_id}, f, indent=1)
+
+    def _load_onnx(self):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_LOCAL_ONNX=true needs onnxruntime and tokenizers") from e
+        export_dir = self._onnx_export_dir()
+        if not os.path.exists(os.path.join(export_dir, "export.json")):
+            self._export_onnx(export_dir)
+        with open(os.path.join(export_dir, "export.json"), "r", encoding="utf-8") as f:
+            self.export_info = json.load(f)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(export_dir, "model_int8.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_tokens or self.export_info["max_tokens"])
+        self.tokenizer.enable_padding(pad_id=self.export_info["pad_token_id"], pad_token=self.export_info["pad_token"])
+        self.dimensions = self.export_info["dimensions"]
+
+    def _encode_onnx(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))  # Similar lengths per batch: less padding
+        for start in range(0, len(order), self.batch_size):
+            indexes = order[start:start + self.batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in indexes])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            hidden = self.session.run(["last_hidden_state"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+            if self.export_info["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = attention_mask[:, :, None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.export_info["normalize"]:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(indexes, pooled.tolist()):
+                vectors[i] = vector
+            self.batches_sent += 1
+        return vectors
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        with self._inference_lock:
+            if self.use_onnx:
+                return self._encode_onnx(texts)
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                        show_progress_bar=False)
+            self.batches_sent += -(-len(texts) // self.batch_size)
+            return vectors.tolist()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-local")
+            return self._executor
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        start = time.perf_counter()
+        vectors = self._encode(texts)
+        logger.info(f"Embedded {len(texts)} documents locally in {time.perf_counter() - start:.2f}s")
+        return vectors
+
+    def embed_documents_fallback(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if not text:
+            return []
+        return self._encode([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async embed_documents: inference runs on the local embedding thread, the event loop stays free."""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.embed_query, text)
+
+# --- Persistent Embedding Cache ---
+class EmbeddingCache:
+    """
+    SQLite cache of embeddings keyed by (model name, dimensions, sha256 of the text).
+    Vectors are stored as float32 blobs; least recently used entries are evicted
+    once the stored vectors exceed ``max_bytes``.
+    """
+
+    def __init__(self, path: str, max_bytes: int, model_name: str, dimensions: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, dimensions INTEGER NOT NULL, text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, dimensions, text_hash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache at '{path}': {entries} entries, {self._total_bytes / 1e6:.1f} MB")
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors of ``texts`` (None for the misses), in order."""
+        hashes = [self.text_hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):  # SQLite limits the number of bound parameters
+                chunk = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND dimensions = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [self.model_name, self.dimensions, *chunk],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+            if found:
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                    [(now, self.model_name, self.dimensions, text_hash) for text_hash in found],
+                )
+                self._db.commit()
+            vectors = [found.get(text_hash) for text_hash in hashes]
+            hit_count = sum(1 for vector in vectors if vector is not None)
+            self.hits += hit_count
+            self.misses += len(vectors) - hit_count
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store vectors; empty, all-zero (failed) and wrong-sized vectors are not cached."""
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            if len(vector) != self.dimensions or not any(vector):
+                continue
+            rows.append((self.model_name, self.dimensions, self.text_hash(text), array("f", vector).tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            for row in rows:
+                previous = self._db.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                    row[:3],
+                ).fetchone()
+                self._total_bytes += len(row[3]) - (previous[0] if previous else 0)
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            if self.max_bytes and self._total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._db.commit()
+
+    def _evict(self, target_bytes: int) -> None:
+        """Delete least recently used entries until ``target_bytes`` remain (lock held)."""
+        evicted = 0
+        while self._total_bytes > target_bytes:
+            rows = self._db.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            doomed = []
+            for rowid, size in rows:
+                if self._total_bytes <= target_bytes:
+                    break
+                doomed.append((rowid,))
+                self._total_bytes -= size
+            self._db.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+            evicted += len(doomed)
+        logger.debug(f"Evicted {evicted} embedding cache entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._total_bytes,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings client: texts already in the EmbeddingCache are not sent to the API.
+
+    Other attributes (batches_sent, timeouts, ...) are those of the wrapped client.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def __getattr__(self, name):
+        embeddings = self.__dict__.get("embeddings")
+        if embeddings is None:
+            raise AttributeError(name)
+        return getattr(embeddings, name)
+
+    def _embed_cached(self, texts: List[str], embed_misses: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            new_vectors = embed_misses(missing)
+            self.cache.put_many(missing, new_vectors)
+            by_text = dict(zip(missing, new_vectors))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} texts cached")
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, self.embeddings.embed_documents)
+
+    def embed_documents_fallback(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, self.embeddings.embed_documents_fallback)
+
+    def embed_query(self, text: str) -> List[float]:
+        if not text:
+            return self.embeddings.embed_query(text)
+        return self._embed_cached([text], lambda missing: [self.embeddings.embed_query(missing[0])])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(None, self.cache.get_many, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            new_vectors = await self.embeddings.aembed_documents(missing)
+            await loop.run_in_executor(None, self.cache.put_many, missing, new_vectors)
+            by_text = dict(zip(missing, new_vectors))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_query, text)
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, or None when caching is disabled."""
+    global _embedding_cache
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+                                                  _embedding_model_key(), config.EMBEDDING_DIMENSIONS)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Embedding cache disabled, could not open '{config.EMBEDDING_CACHE_PATH}': {e}")
+                return None
+    return _embedding_cache
+
+# --- Precomputed Query Embeddings ---
+class PrecomputedQueryEmbeddings(Embeddings):
+    """
+    Serves embed_query for a fixed set of known queries (attribute names, extraction
+    instructions) from a table built once per (embedding model, dimensions, prompt version).
+
+    The prompt version is a digest of the known queries, so editing a prompt builds a
+    new table. The table is embedded in one embed_documents call on first use and saved
+    under ``table_dir``; later processes load it. Other texts go to the wrapped embeddings.
+    """
+
+    def __init__(self, embeddings: Embeddings, queries: List[str], table_dir: str):
+        self.embeddings = embeddings
+        self.queries = sorted(set(query for query in queries if query))
+        self.prompt_version = hashlib.sha256("\x00".join(self.queries).encode("utf-8")).hexdigest()[:12]
+        model_slug = re.sub(r"[^A-Za-z0-9._-]+", "_", _embedding_model_key())
+        self.path = os.path.join(table_dir, f"{model_slug}-{config.EMBEDDING_DIMENSIONS}-{self.prompt_version}.json")
+        self.table: Optional[Dict[str, List[float]]] = None
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        embeddings = self.__dict__.get("embeddings")
+        if embeddings is None:
+            raise AttributeError(name)
+        return getattr(embeddings, name)
+
+    def _load_or_build(self) -> Dict[str, List[float]]:
+        with self._lock:
+            if self.table is not None:
+                return self.table
+            table: Dict[str, List[float]] = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    table = json.load(f)["queries"]
+                logger.info(f"Loaded {len(table)} precomputed query embeddings from '{self.path}'")
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not read query embedding table '{self.path}', rebuilding it: {e}")
+            missing = [query for query in self.queries if query not in table]
+            if missing:
+                start = time.perf_counter()
+                try:
+                    vectors = self.embeddings.embed_documents(missing)
+                except Exception as e:
+                    logger.error(f"Could not precompute query embeddings, queries will be embedded one by one: {e}")
+                    vectors = []
+                for query, vector in zip(missing, vectors):
+                    # Failed (all-zero) vectors are left out and embedded again when queried
+                    if len(vector) == config.EMBEDDING_DIMENSIONS and any(vector):
+                        table[query] = vector
+                logger.info(f"Precomputed {len(table)}/{len(self.queries)} query embeddings "
+                             f"(prompt version {self.prompt_version}) in {time.perf_counter() - start:.2f}s")
+                if len(table) == len(self.queries):
+                    try:
+                        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                        tmp_path = f"{self.path}.tmp"
+                        with open(tmp_path, "w", encoding="utf-8") as f:
+                            json.dump({"model": _embedding_model_key(), "dimensions": config.EMBEDDING_DIMENSIONS,
+                                       "prompt_version": self.prompt_version, "queries": table}, f)
+                        os.replace(tmp_path, self.path)
+                    except OSError as e:
+                        logger.warning(f"Could not save query embedding table '{self.path}': {e}")
+            self.table = table
+            return table
+
+    def warm(self) -> None:
+        """Build or load the table now instead of on the first query."""
+        self._load_or_build()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._load_or_build().get(text)
+        if vector is not None:
+            self.hits += 1
+            logger.debug(f"Query embedding served from the precomputed table: '{text[:60]}'")
+            return vector
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
 # --- Embedding Function Setup ---
 @logger.catch(reraise=True) # Automatically log exceptions
-def get_embedding_function():
+def get_embedding_function(known_queries: Optional[List[str]] = None):
     """
     Creates and returns the embedding function based on configuration.
+    Args:
+        known_queries: Fixed retrieval queries (attribute names, extraction instructions)
+            whose embeddings are precomputed once, so retrieving them makes no embedding call.
     Returns:
-        HuggingFaceAPIEmbeddings instance if successful, None otherwise.
+        HuggingFaceAPIEmbeddings instance, or LocalEmbeddings when config.EMBEDDING_BACKEND
+        is "local" (wrapped in CachedEmbeddings when config.EMBEDDING_CACHE_ENABLED and in
+        PrecomputedQueryEmbeddings when ``known_queries`` are given) if successful, None otherwise.
     """
     try:
-        # Use the custom HuggingFace API embeddings
-        embedding_function = HuggingFaceAPIEmbeddings(
-            api_url=config.EMBEDDING_API_URL
-        )
-        
+        if config.EMBEDDING_BACKEND == "local":
+            # Same model on CPU in this process: no cold starts or timeouts of the API
+            embedding_function = LocalEmbeddings(config.EMBEDDING_MODEL_NAME)
+        elif config.EMBEDDING_BACKEND == "api":
+            # Use the custom HuggingFace API embeddings
+            embedding_function = HuggingFaceAPIEmbeddings(
+                api_url=config.EMBEDDING_API_URL
+            )
+        else:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND '{config.EMBEDDING_BACKEND}' (expected 'api' or 'local')")
+
         # Test the embedding function with a simple query
         test_embedding = embedding_function.embed_query("test")
         if test_embedding and len(test_embedding) > 0:
             logger.success(f"Embedding function initialized successfully with {len(test_embedding)} dimensions")
+            cache = get_embedding_cache()
+            if cache is not None:
+                embedding_function = CachedEmbeddings(embedding_function, cache)
+            if known_queries:
+                embedding_function = PrecomputedQueryEmbeddings(embedding_function, known_queries,
+                                                                config.QUERY_EMBEDDINGS_DIR)
             return embedding_function
         else:
             logger.error("Embedding function test failed - returned empty embedding")
@@ -364,17 +892,148 @@ class SimpleRetriever:
         
         return filtered
 
+# --- Streaming Vector Store Setup ---
+class _FallbackOnErrorEmbeddings(Embeddings):
+    """Embeds with the batched API and falls back to one request per document when a batch fails."""
+
+    def __init__(self, embedding_function):
+        self.embedding_function = embedding_function
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        try:
+            return self.embedding_function.embed_documents(texts)
+        except Exception as e:
+            if not hasattr(self.embedding_function, 'embed_documents_fallback'):
+                raise
+            logger.warning(f"Batch embedding failed, using per-document fallback for {len(texts)} texts: {e}")
+            return self.embedding_function.embed_documents_fallback(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding_function.embed_query(text)
+
+
+async def setup_vector_store_streaming(
+    document_stream: AsyncIterator[Document],
+    embedding_function,
+    batch_size: Optional[int] = None,
+    on_ready: Optional[Callable[[SimpleRetriever], None]] = None,
+) -> Tuple[Optional[SimpleRetriever], List[Document], List[Document]]:
+    """
+    Index documents into the Chroma collection while they are still being produced.
+
+    Documents from ``document_stream`` (e.g. pdf_processor.stream_uploaded_pdfs) are
+    embedded and upserted in micro-batches of at most ``batch_size`` documents
+    (defaults to config.STREAM_INDEX_BATCH_SIZE). A batch is sent as soon as the
+    previous one is done, so OCR, embedding and indexing overlap. ``on_ready`` is
+    called with the retriever once the first batch is indexed. The documents of a
+    micro-batch that fails are retried once the stream ends.
+    Returns the retriever (None if nothing could be indexed), all streamed documents
+    and the documents that are still not indexed after that retry.
+    """
+    persist_directory = config.CHROMA_PERSIST_DIRECTORY
+    collection_name = config.COLLECTION_NAME
+    batch_size = max(1, batch_size or config.STREAM_INDEX_BATCH_SIZE)
+
+    if not persist_directory:
+        logger.warning("Persistence directory not configured. Cannot setup vector store.")
+        docs = [doc async for doc in document_stream]
+        return None, docs, docs
+    if not embedding_function:
+        logger.error("Embedding function is not available for setup_vector_store_streaming.")
+        docs = [doc async for doc in document_stream]
+        return None, docs, docs
+
+    loop = asyncio.get_running_loop()
+    start_time = time.perf_counter()
+    vector_store = await loop.run_in_executor(None, lambda: Chroma(
+        collection_name=collection_name,
+        embedding_function=_FallbackOnErrorEmbeddings(embedding_function),
+        persist_directory=persist_directory
+    ))
+    retriever: Optional[SimpleRetriever] = None
+    all_docs: List[Document] = []
+    pending: List[Document] = []
+    failed_docs: List[Document] = []  # Micro-batches that failed, retried once the stream ends
+    wakeup = asyncio.Event()
+    stream_done = False
+    indexed_count = 0
+    batch_count = 0
+
+    def mark_ready():
+        nonlocal retriever
+        retriever = SimpleRetriever(vectorstore=vector_store, config=config)
+        logger.success(f"Retriever ready after {time.perf_counter() - start_time:.2f}s "
+                       f"({indexed_count} documents indexed)")
+        if on_ready is not None:
+            on_ready(retriever)
+
+    async def index_pending():
+        nonlocal indexed_count, batch_count
+        while True:
+            await wakeup.wait()
+            if not pending:
+                if stream_done:
+                    return
+                wakeup.clear()
+                continue
+            batch = pending[:batch_size]
+            del pending[:batch_size]
+            try:
+                await loop.run_in_executor(None, vector_store.add_documents, batch)
+                indexed_count += len(batch)
+                batch_count += 1
+                logger.debug(f"Indexed micro-batch {batch_count} ({len(batch)} documents, {indexed_count} total)")
+            except Exception as e:
+                failed_docs.extend(batch)
+                logger.warning(f"Failed to index a micro-batch of {len(batch)} documents, retrying after the stream: {e}")
+                continue
+            if retriever is None:
+                mark_ready()
+
+    indexer = asyncio.ensure_future(index_pending())
+    try:
+        async for doc in document_stream:
+            all_docs.append(doc)
+            pending.append(doc)
+            wakeup.set()
+    finally:
+        stream_done = True
+        wakeup.set()
+        await indexer
+
+    if failed_docs:
+        try:
+            await loop.run_in_executor(None, vector_store.add_documents, failed_docs)
+            indexed_count += len(failed_docs)
+            logger.info(f"Indexed the {len(failed_docs)} documents of failed micro-batches on retry")
+            failed_docs = []
+            if retriever is None:
+                mark_ready()
+        except Exception as e:
+            logger.error(f"Retry of {len(failed_docs)} documents of failed micro-batches failed: {e}", exc_info=True)
+
+    if indexed_count and persist_directory and hasattr(vector_store, "persist"):
+        logger.info(f"Persisting vector store to directory: {persist_directory}")
+        await loop.run_in_executor(None, vector_store.persist)
+
+    logger.info(f"Streaming indexing of '{collection_name}' finished in {time.perf_counter() - start_time:.2f}s: "
+                f"{indexed_count} documents indexed in {batch_count} micro-batches, {len(failed_docs)} not indexed")
+    all_docs.sort(key=lambda doc: (doc.metadata.get('source', ''), doc.metadata.get('page', 0), doc.metadata.get('chunk', 0)))
+    return retriever, all_docs, failed_docs
+
 # --- Vector Store Setup Functions ---
 @logger.catch(reraise=True)
 def setup_vector_store(
     documents: List[Document],
     embedding_function,
+    ids: Optional[List[str]] = None,
 ) -> Optional[SimpleRetriever]:
     """
     Sets up a Chroma vector store with the provided documents and embedding function.
     Args:
         documents: List of documents to add to the vector store.
         embedding_function: The embedding function to use.
+        ids: Optional stable document ids; documents whose id is already stored are replaced.
     Returns:
         A SimpleRetriever object if successful, otherwise None.
     """
@@ -396,6 +1055,7 @@ def setup_vector_store(
             vector_store = Chroma.from_documents(
                 documents=documents,
                 embedding=embedding_function,
+                ids=ids,
                 collection_name=collection_name,
                 persist_directory=persist_directory
             )
@@ -419,6 +1079,7 @@ def setup_vector_store(
                 vector_store = Chroma.from_documents(
                     documents=documents,
                     embedding=fallback_embedding,
+                    ids=ids,
                     collection_name=collection_name,
                     persist_directory=persist_directory
                 )
@@ -439,4 +1100,26 @@ def setup_vector_store(
 
     except Exception as e:
         logger.error(f"Failed to setup vector store: {e}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
+
+
+def delete_documents_where(metadata_key: str, values: List[str], keep_ids: Optional[List[str]] = None) -> int:
+    """
+    Deletes the documents of the persisted collection whose ``metadata_key`` is one of ``values``.
+    Args:
+        metadata_key: Metadata field to match.
+        values: Values of ``metadata_key`` whose documents are deleted.
+        keep_ids: Optional ids that are kept even if they match, e.g. the chunks just upserted.
+    Returns:
+        The number of deleted documents.
+    """
+    if not config.CHROMA_PERSIST_DIRECTORY or not values:
+        return 0
+    vector_store = Chroma(collection_name=config.COLLECTION_NAME, persist_directory=config.CHROMA_PERSIST_DIRECTORY)
+    where = {metadata_key: {"$in": list(values)}}
+    keep = set(keep_ids or ())
+    existing = [doc_id for doc_id in vector_store._collection.get(where=where, include=[])["ids"] if doc_id not in keep]
+    if existing:
+        vector_store._collection.delete(ids=existing)
+        logger.info(f"Deleted {len(existing)} stale documents of {len(values)} re-ingested files from '{config.COLLECTION_NAME}'")
+    return len(existing)
\ No newline at end of file